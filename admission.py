@@ -0,0 +1,156 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from flask import Flask, g, jsonify, request
+
+import metrics
+from user_directory import directory
+
+# Admission control
+#
+# Rejects requests with 429 before any authorization or order work starts when
+# the caller is over their budget, so one noisy client can't use up the
+# workers everyone else needs. Each route has a token bucket per user
+# (X-User-Username) and per org, and requests to limited routes share a cap on
+# how many may be in flight at once.
+#
+# Limits per route are in requests per second with a burst allowance. Override
+# them with ADMISSION_LIMITS, a JSON object keyed by endpoint name ("default"
+# applies to all others), e.g.
+#
+#   {"list_orders": {"user_rate": 2, "user_burst": 5}}
+#
+# Set ADMISSION_CONTROL=0 to turn it all off.
+
+ENABLED = os.environ.get("ADMISSION_CONTROL", "1") != "0"
+# Requests to limited routes being handled at once, per worker.
+MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "32"))
+# How long a request may wait for an in-flight slot before it's rejected.
+QUEUE_SECONDS = float(os.environ.get("ADMISSION_QUEUE_SECONDS", "0.05"))
+# Most buckets kept; the least recently used are dropped (and start full).
+MAX_BUCKETS = int(os.environ.get("ADMISSION_MAX_BUCKETS", "100000"))
+
+# Routes that never touch orders or authorization aren't limited.
+EXEMPT_ENDPOINTS = ("prometheus_metrics", "static")
+
+REJECTED = metrics.Counter(
+    "admission_rejected_total", "Requests rejected by admission control.", ("route", "reason")
+)
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    user_rate: float = 20
+    user_burst: float = 40
+    org_rate: float = 200
+    org_burst: float = 400
+
+
+def _load_limits() -> Dict[str, RouteLimit]:
+    overrides = json.loads(os.environ.get("ADMISSION_LIMITS", "{}"))
+    limits = {"default": RouteLimit(**overrides.pop("default", {}))}
+    for endpoint, limit in overrides.items():
+        limits[endpoint] = RouteLimit(**{**vars(limits["default"]), **limit})
+    return limits
+
+
+LIMITS = _load_limits()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token. Returns 0 on success, or else the seconds until one
+        will be available."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class AdmissionController:
+    def __init__(self, limits: Dict[str, RouteLimit] = LIMITS, max_in_flight: int = MAX_IN_FLIGHT):
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[Tuple[str, str, str], TokenBucket]" = OrderedDict()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def _bucket(self, key: Tuple[str, str, str], rate: float, burst: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+            if len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, endpoint: str, username: str, org: Optional[str]) -> Tuple[str, float]:
+        """("", 0) if the request may go ahead, else the reason it was
+        rejected and the seconds to wait before retrying."""
+        limit = self.limits.get(endpoint, self.limits["default"])
+        buckets = [("user", username, limit.user_rate, limit.user_burst)]
+        if org is not None:
+            buckets.append(("org", org, limit.org_rate, limit.org_burst))
+        with self._lock:
+            for kind, name, rate, burst in buckets:
+                wait = self._bucket((endpoint, kind, name), rate, burst).take()
+                if wait:
+                    return kind, wait
+        return "", 0
+
+    def enter(self) -> bool:
+        return self._in_flight.acquire(timeout=QUEUE_SECONDS)
+
+    def leave(self) -> None:
+        self._in_flight.release()
+
+
+controller = AdmissionController()
+
+
+def _reject(reason: str, retry_after: float):
+    REJECTED.inc(request.endpoint or "", reason)
+    headers = {"Retry-After": str(max(1, math.ceil(min(retry_after, 3600))))}
+    return jsonify({"error": "Too many requests, slow down"}), 429, headers
+
+
+def before_request():
+    if request.method == "OPTIONS" or request.endpoint in EXEMPT_ENDPOINTS:
+        return None
+
+    username = request.headers.get("X-User-Username", "")
+    user = directory.get(username) if username else None
+    reason, wait = controller.admit(request.endpoint or "", username, user and user["org"])
+    if reason:
+        return _reject(reason, wait)
+
+    if not controller.enter():
+        return _reject("concurrency", QUEUE_SECONDS)
+    g.admitted = True
+    return None
+
+
+def teardown_request(exc=None) -> None:
+    if g.pop("admitted", False):
+        controller.leave()
+
+
+def init_app(app: Flask) -> None:
+    if ENABLED:
+        app.before_request(before_request)
+        app.teardown_request(teardown_request)
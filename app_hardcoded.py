@@ -2,10 +2,17 @@ import logging
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from rich.logging import RichHandler
+
+import admission
+import idempotency
+import metrics
+import principals
+import wire_format
+from startup import is_reloader_parent, warm_up
 
 # Fake databasey stuff
-from data import USERS, User, Order, OrderWithPermissions, OrderStatus
+from data import OrderWithPermissions, OrderStatus
+from user_directory import directory
 from permissions import RBAC
 
 # Fake orders service
@@ -15,11 +22,23 @@ from order_service import OrderService
 def create_app() -> Flask:
     app = Flask(__name__)
     CORS(app)
+    metrics.init_app(app)
+    # Before idempotency, so kept responses are stored uncompressed.
+    wire_format.init_app(app)
+    idempotency.init_app(app)
+    admission.init_app(app)
     setup_logging()
     return app
 
 
 def setup_logging() -> None:
+    # Leave logging alone if the host (e.g. a WSGI server) already set it up,
+    # and only pay for importing rich when we do configure it.
+    if logging.getLogger().handlers:
+        return
+
+    from rich.logging import RichHandler
+
     logging.basicConfig(
         level=logging.DEBUG,
         format="%(message)s",
@@ -32,20 +51,25 @@ app = create_app()
 # Request hooks
 @app.before_request
 def attach_user():
-    request.user = User(
-        username=request.headers.get("X-User-Username"),
-        role=request.headers.get("X-User-Role"),
-        org=request.headers.get("X-User-Org"),
-    )
+    # Role and org come from the user directory; X-User-Role and X-User-Org
+    # sent by the client are ignored.
+    request.user = principals.resolve(request.headers.get("X-User-Username"))
 
 
 # Routes
 @app.route("/orders", methods=["GET"])
 def list_orders():
-    orders = OrderService.load_orders()
     user_role = request.user.role
     user_org = request.user.org
+    # Computed once: every order gets the user's role permissions.
+    order_permissions = list(request.user.permissions)
+    if "view_orders" not in order_permissions:
+        return (
+            jsonify({"error": f"Permission denied. Role '{user_role}' cannot view orders"}),
+            403,
+        )
 
+    orders = OrderService.load_orders()
     orders_w_permissions = []
     for order in orders.values():
         # TODO(2): Skip orders from other organizations. You'll now see that
@@ -54,8 +78,6 @@ def list_orders():
         # if order["org"] != user_org:
         #    continue
 
-        order_permissions = [p.value for p in RBAC[user_role]]
-
         # TODO(5): We can prevent the button for canceling an order from even
         # displaying.
 
@@ -77,7 +99,7 @@ def list_orders():
 def create_order():
     # Get the user's permissions based on their role
     user_role = request.user.role
-    permissions = [p.value for p in RBAC[user_role]]
+    permissions = request.user.permissions
     # Verify that the user has the "create_order" permission
     if not "create_order" in permissions:
         return (
@@ -85,32 +107,21 @@ def create_order():
             403,
         )
  
-    orders = OrderService.load_orders()
     order_data = request.json
-
-    order_id = (
-        str(max(int(order_id) for order_id in orders.keys()) + 1) if orders else "1"
-    )
-
-    new_order = Order(
-        id=order_id,
+    new_order = OrderService.create_order(
         org=request.user.org,
         sold_by=request.user.username,
         customer=order_data["customer"],
         items=order_data["items"],
-        status=OrderStatus.PENDING.value,
     )
-
-    orders[order_id] = vars(new_order)
-    OrderService.save_orders(orders)
-    return jsonify(vars(new_order)), 201
+    return jsonify(new_order), 201
 
 
 @app.route("/orders/<order_id>", methods=["DELETE"])
 def delete_order(order_id: str):
     # Get the user's permissions based on their role
     user_role = request.user.role
-    permissions = [p.value for p in RBAC[user_role]]
+    permissions = request.user.permissions
     # Verify that the user has the "delete_order" permission
     if not "delete_order" in permissions:
         return (
@@ -129,8 +140,7 @@ def delete_order(order_id: str):
             403,
         )
 
-    del orders[order_id]
-    OrderService.save_orders(orders)
+    OrderService.delete_order(order_id)
     return "", 204
 
 
@@ -138,7 +148,7 @@ def delete_order(order_id: str):
 def fulfill_order(order_id: str):
     # Get the user's permissions based on their role
     user_role = request.user.role
-    permissions = [p.value for p in RBAC[user_role]]
+    permissions = request.user.permissions
     # Verify that the user has the "fulfill_order" permission
     if not "fulfill_order" in permissions:
         return (
@@ -167,7 +177,7 @@ def fulfill_order(order_id: str):
 def cancel_order(order_id: str):
     # Get the user's permissions based on their role
     user_role = request.user.role
-    permissions = [p.value for p in RBAC[user_role]]
+    permissions = request.user.permissions
     # Verify that the user has the "cancel_order" permission
     if not "cancel_order" in permissions:
         return (
@@ -198,15 +208,24 @@ def cancel_order(order_id: str):
 
 @app.route("/users", methods=["GET"])
 def get_users():
+    # Optionally scoped to one org and paginated; X-Total-Count carries the
+    # number of matching users.
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", type=int)
+    if offset < 0 or (limit is not None and limit < 0):
+        return jsonify({"error": "offset and limit must not be negative"}), 400
+    users, total = directory.page(org=request.args.get("org"), offset=offset, limit=limit)
     users_with_permissions = {
         user_name: {
             "org": user_data["org"],
             "role": user_data["role"],
             "orgPermissions": [p.value for p in RBAC[user_data["role"]]],
         }
-        for user_name, user_data in USERS.items()
+        for user_name, user_data in users
     }
-    return jsonify(users_with_permissions)
+    response = jsonify(users_with_permissions)
+    response.headers["X-Total-Count"] = str(total)
+    return response
 
 
 # Not an "in-demo" endpoint; just a convenience feature for presenters.
@@ -217,4 +236,6 @@ def reset_orders():
 
 
 if __name__ == "__main__":
+    if not is_reloader_parent():
+        warm_up()
     app.run(debug=True)
@@ -2,27 +2,49 @@ import logging
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from rich.logging import RichHandler
+
+import admission
+import idempotency
+import metrics
+import principals
+import wire_format
+from startup import is_reloader_parent, warm_up
 
 # Fake databasey stuff
-from data import USERS, User, Order, OrderWithPermissions, OrderStatus
+from data import OrderWithPermissions, OrderStatus
+from user_directory import directory
 from permissions import RBAC
 
 # Fake orders service
 from order_service import OrderService
+from work_queue import QueueFull
 
 # authz function (decorator)
+from authz_decorators import require_permission
 from authz_oso import authorize_order_action
+import permission_view
 
 # App configuration
 def create_app() -> Flask:
     app = Flask(__name__)
     CORS(app)
+    metrics.init_app(app)
+    # Before idempotency, so kept responses are stored uncompressed.
+    wire_format.init_app(app)
+    idempotency.init_app(app)
+    admission.init_app(app)
     setup_logging()
     return app
 
 
 def setup_logging() -> None:
+    # Leave logging alone if the host (e.g. a WSGI server) already set it up,
+    # and only pay for importing rich when we do configure it.
+    if logging.getLogger().handlers:
+        return
+
+    from rich.logging import RichHandler
+
     logging.basicConfig(
         level=logging.DEBUG,
         format="%(message)s",
@@ -36,106 +58,145 @@ app = create_app()
 # Request hooks
 @app.before_request
 def attach_user():
-    request.user = User(
-        username=request.headers.get("X-User-Username"),
-        role=request.headers.get("X-User-Role"),
-        org=request.headers.get("X-User-Org"),
-    )
+    # Role and org come from the user directory; X-User-Role and X-User-Org
+    # sent by the client are ignored.
+    request.user = principals.resolve(request.headers.get("X-User-Username"))
 
 
 # Routes
 @app.route("/orders", methods=["GET"])
 def list_orders():
-    orders = OrderService.load_orders()
-    user_role = request.user.role
-    user_org = request.user.org
-
-    orders_w_permissions = []
-    for order in orders.values():
-        # TODO(2): Skip orders from other organizations. You'll now see that
-        # each user can only see their own org's orders.
-
-        # if order["org"] != user_org:
-        #    continue
-
-        order_permissions = [p.value for p in RBAC[user_role]]
-
-        # TODO(5): We can prevent the button for canceling an order from even
-        # displaying.
-
-        # order_permissions = []
-        # for p in RBAC[user_role]:
-        #     if p == RBACPermission.CANCEL_ORDER and user_role == "sales":
-        #         if order["sold_by"] == request.user.username:
-        #             order_permissions.append(p.value)
-        #     else:
-        #         order_permissions.append(p.value)
-        orders_w_permissions.append(
-            OrderWithPermissions(**order, permissions=order_permissions)
-        )
+    # Each user's per-order permissions are kept materialized, following the
+    # rules in policy.polar, so listing is a lookup rather than a policy check
+    # per order.
+    orders_w_permissions = [
+        OrderWithPermissions(**order, permissions=list(permissions))
+        for order, permissions in permission_view.list_orders(request.user.username)
+    ]
+
+    # Closed orders are archived after a while; only read them when asked.
+    if "archived" in request.args.get("include", "").split(","):
+        listed = {order.id for order in orders_w_permissions}
+        for order, permissions in permission_view.list_archived_orders(request.user.username):
+            if order["id"] not in listed:
+                orders_w_permissions.append(
+                    OrderWithPermissions(**order, permissions=list(permissions))
+                )
+
+    return jsonify(orders_w_permissions)
+
+
+@app.route("/orders/search", methods=["GET"])
+@require_permission("view_orders")
+def search_orders():
+    # Only the caller's org is searched, and only matches they can access
+    # are loaded.
+    order_ids = OrderService.search(
+        request.user.org, request.args.get("q", ""), request.args.get("status")
+    )
+    permissions_by_order = permission_view.view.for_orders(request.user.username, order_ids)
+    order_ids = [order_id for order_id in order_ids if order_id in permissions_by_order]
+
+    orders = OrderService.org_snapshot(request.user.org) if order_ids else {}
+    orders_w_permissions = [
+        OrderWithPermissions(**orders[order_id], permissions=list(permissions_by_order[order_id]))
+        for order_id in order_ids
+        if order_id in orders
+    ]
 
     return jsonify(orders_w_permissions)
 
 
+@app.route("/orders/stats", methods=["GET"])
+@require_permission("view_orders")
+def order_stats():
+    # Stats only ever cover the caller's own org.
+    return jsonify(OrderService.stats(request.user.org))
+
+
 @app.route("/orders", methods=["POST"])
 @authorize_order_action("create_order")
 def create_order():
-    orders = OrderService.load_orders()
     order_data = request.json
-
-    order_id = (
-        str(max(int(order_id) for order_id in orders.keys()) + 1) if orders else "1"
-    )
-
-    new_order = Order(
-        id=order_id,
+    new_order = OrderService.create_order(
         org=request.user.org,
         sold_by=request.user.username,
         customer=order_data["customer"],
         items=order_data["items"],
-        status=OrderStatus.PENDING.value,
     )
-
-    orders[order_id] = vars(new_order)
-    OrderService.save_orders(orders)
-    return jsonify(vars(new_order)), 201
+    return jsonify(new_order), 201
 
 
 @app.route("/orders/<order_id>", methods=["DELETE"])
 @authorize_order_action("delete_order")
 def delete_order(order_id: str):
-    orders = OrderService.load_orders()
-    del orders[order_id]
-    OrderService.save_orders(orders)
+    OrderService.delete_order(order_id)
     return "", 204
 
 
 @app.route("/orders/<order_id>/fulfill", methods=["POST"])
 @authorize_order_action("fulfill_order")
 def fulfill_order(order_id: str):
-    order = OrderService.update_order_status(order_id, OrderStatus.FULFILLED)
-    return jsonify(order)
+    return update_status(order_id, OrderStatus.FULFILLED)
 
 
 @app.route("/orders/<order_id>/cancel", methods=["POST"])
 @authorize_order_action("cancel_order")
 def cancel_order(order_id: str):
     orders = OrderService.get_order(order_id)
-    order = OrderService.update_order_status(order_id, OrderStatus.CANCELLED)
-    return jsonify(order)
+    return update_status(order_id, OrderStatus.CANCELLED)
+
+
+def update_status(order_id: str, status: OrderStatus):
+    # Clients that send "Prefer: respond-async" get 202 and a background job
+    # to poll; others get the status change made right here, as before.
+    if "respond-async" not in request.headers.get("Prefer", ""):
+        order = OrderService.update_order_status(order_id, status)
+        if order is None:
+            return jsonify({"error": "Order not found"}), 404
+        return jsonify(order)
+
+    try:
+        job = OrderService.update_order_status(
+            order_id, status, background=True, owner=request.user.username
+        )
+    except QueueFull:
+        return jsonify({"error": "Too many pending order updates, try again later"}), 503
+    return jsonify(job.to_dict()), 202, {"Location": f"/jobs/{job.id}"}
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    if not OrderService.jobs.is_local(job_id):
+        # Jobs are only tracked by the worker process that queued them.
+        error = "Job not found: it was queued by another worker process, which alone tracks it"
+        return jsonify({"error": error}), 404
+    job = OrderService.jobs.get(job_id)
+    if job is None or job.owner != request.user.username:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
 
 
 @app.route("/users", methods=["GET"])
 def get_users():
+    # Optionally scoped to one org and paginated; X-Total-Count carries the
+    # number of matching users.
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", type=int)
+    if offset < 0 or (limit is not None and limit < 0):
+        return jsonify({"error": "offset and limit must not be negative"}), 400
+    users, total = directory.page(org=request.args.get("org"), offset=offset, limit=limit)
     users_with_permissions = {
         user_name: {
             "org": user_data["org"],
             "role": user_data["role"],
             "orgPermissions": [p.value for p in RBAC[user_data["role"]]],
         }
-        for user_name, user_data in USERS.items()
+        for user_name, user_data in users
     }
-    return jsonify(users_with_permissions)
+    response = jsonify(users_with_permissions)
+    response.headers["X-Total-Count"] = str(total)
+    return response
 
 
 # Not an "in-demo" endpoint; just a convenience feature for presenters.
@@ -146,4 +207,6 @@ def reset_orders():
 
 
 if __name__ == "__main__":
+    if not is_reloader_parent():
+        warm_up()
     app.run(debug=True)
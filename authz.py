@@ -1,10 +1,15 @@
 from typing import Dict
 from data import User
 from permissions import RBAC
+from principals import Principal
 
 # Abstracted authorization logic
 
 def has_permission(user: User, permission: str):
+    # Resolved principals carry their role's permissions already.
+    if isinstance(user, Principal):
+        return permission in user.permissions
+
     user_role = user.role
     permissions = [p.value for p in RBAC[user_role]]
 
@@ -1,14 +1,21 @@
-from typing import Dict
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
 from data import User
 from permissions import RBAC
+from principals import Principal
 from flask import jsonify, request
 from functools import wraps
-from data import User
-from order_service import OrderService
+import metrics
+import order_context
 
 # Abstracted authorization logic
 
 def has_permission(user: User, permission: str):
+    # Resolved principals carry their role's permissions already.
+    if isinstance(user, Principal):
+        return permission in user.permissions
+
     user_role = user.role
     permissions = [p.value for p in RBAC[user_role]]
 
@@ -25,60 +32,107 @@ def user_is_owner_if_in_sales(user: User, order: Dict):
     # who has an invalid role for the action 
     return True
 
-def require_permission(permission):
+# Authorization plan
+#
+# Each requirement knows how expensive it is to check. Stacked requirements on a
+# route are compiled once, at registration, into a single guard that runs them
+# cheapest first, loads the order at most once and stops at the first failure.
+
+# Requirement costs
+RBAC_COST = 0  # only looks at the user
+ORDER_COST = 1  # needs the order loaded
+REMOTE_COST = 2  # calls out to another service
+
+
+@dataclass(frozen=True)
+class Requirement:
+    name: str
+    cost: int
+    check: Callable[[User, Optional[str], Optional[Dict]], bool]
+    error: Callable[[User], str]
+    needs_order: bool = False
+
+
+def permission(permission: str) -> Requirement:
+    return Requirement(
+        name=permission,
+        cost=RBAC_COST,
+        check=lambda user, order_id, order: has_permission(user, permission),
+        error=lambda user: f"Permission denied. Role '{user.role}' cannot {permission}",
+    )
+
+
+def same_org() -> Requirement:
+    return Requirement(
+        name="same_org",
+        cost=ORDER_COST,
+        check=lambda user, order_id, order: has_same_org(user, order),
+        error=lambda user: "Unauthorized to access order from another org",
+        needs_order=True,
+    )
+
+
+def owner_if_sales() -> Requirement:
+    return Requirement(
+        name="owner_if_sales",
+        cost=ORDER_COST,
+        check=lambda user, order_id, order: user_is_owner_if_in_sales(user, order),
+        error=lambda user: "Sales users can only cancel their own orders",
+        needs_order=True,
+    )
+
+
+def authorize(*requirements: Requirement):
     def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            user: User  = request.user
-            if not has_permission(user, permission):
-                return (
-                    jsonify({"error": f"Permission denied. Role '{user.role}' cannot {permission}"}),
-                    403,
+        # Stacking onto another guard merges into it rather than wrapping it,
+        # so a route only ever pays for one wrapper. Outer requirements come
+        # first to keep declaration order among checks of equal cost.
+        view = getattr(f, "__authz_view__", f)
+        merged = requirements + getattr(f, "__authz_requirements__", ())
+        plan = sorted(merged, key=lambda r: r.cost)
+
+        @wraps(view)
+        def guarded_function(*args, **kwargs):
+            user: User = request.user
+            order_id = kwargs.get("order_id")
+            order = None
+
+            for requirement in plan:
+                if requirement.needs_order and order is None:
+                    order = order_context.find_order(order_id)
+                    if order is None:
+                        return jsonify({"error": "Order not found"}), 404
+
+                start = time.perf_counter()
+                allowed = requirement.check(user, order_id, order)
+                metrics.record_authz(
+                    request.endpoint,
+                    requirement.name,
+                    "remote" if requirement.cost >= REMOTE_COST else "local",
+                    user,
+                    order_id,
+                    allowed,
+                    time.perf_counter() - start,
                 )
+                if not allowed:
+                    return jsonify({"error": requirement.error(user)}), 403
 
-            return f(*args, **kwargs)
+            return view(*args, **kwargs)
 
-        return decorated_function
+        guarded_function.__authz_view__ = view
+        guarded_function.__authz_requirements__ = merged
+        return guarded_function
 
     return decorator
 
 
-def require_same_org():
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            user: User = request.user
-            order_id = kwargs.get("order_id")
-            orders = OrderService.load_orders()
-            order = orders[order_id]
+def require_permission(permission_name: str):
+    return authorize(permission(permission_name))
 
-            if not has_same_org(user, order):
-                return (
-                    jsonify({"error": "Unauthorized to access order from another org"}),
-                    403,
-                )
-            return f(*args, **kwargs)
 
-        return decorated_function
+def require_same_org():
+    return authorize(same_org())
 
-    return decorator
 
 def require_user_is_owner_if_sales():
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            user: User = request.user
-            order_id = kwargs.get("order_id")
-            order = OrderService.get_order(order_id)
-
-            if not user_is_owner_if_in_sales(user, order):
-                return (
-                    jsonify({"error": "Sales users can only cancel their own orders"}),
-                    403,
-                )
-
-            return f(*args, **kwargs)
-
-        return decorated_function
-
-    return decorator
+    return authorize(owner_if_sales())
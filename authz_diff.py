@@ -0,0 +1,282 @@
+"""Compare the authorization implementations decision by decision.
+
+The same rules are written down several times: `authz.py` (as the routes in
+`app_abstracted.py` combine it), the requirements in `authz_decorators.py` (as
+read off `app_decorated.py`'s routes), bare `permissions.RBAC`, the
+materialized view's `order_policy.order_permissions`, and `policy.polar` as
+evaluated by Oso. This enumerates every user x action x order over a dataset
+from `datagen`, asks each implementation, reports every kind of disagreement
+and times each implementation per decision.
+
+Neither app_abstracted nor app_decorated has a per-order view route, so
+view_order is what their `GET /orders` checks, and it lists every org's
+orders. Oso is asked about create_order on the user's organization, as
+policy.polar defines it.
+
+Oso is the in-process stand-in from `oso_local` unless --oso-url points at a
+real server (which should have `policy.polar` loaded).
+
+    python authz_diff.py
+    python authz_diff.py --users 200 --orgs 5 --orders 500
+    python authz_diff.py --oso-url http://localhost:8080 --json diff.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import datagen
+from data import USERS, User
+
+ACTIONS = ("view_order", "create_order", "fulfill_order", "cancel_order", "delete_order")
+IMPLEMENTATIONS = ["authz", "authz_decorators", "rbac", "permission_view", "oso"]
+
+# (username, user, action, order). create_order is asked once per user, about
+# their own org, which is the only org the apps ever create orders in.
+Case = Tuple[str, dict, str, Optional[dict]]
+# Returns None when the implementation has no answer for the action.
+Decide = Callable[[str, dict, str, Optional[dict]], Optional[bool]]
+
+
+def _rbac_name(action: str) -> str:
+    # RBAC and authz.py call the list permission "view_orders".
+    return "view_orders" if action == "view_order" else action
+
+
+def authz_impl() -> Decide:
+    from authz import has_permission, has_same_org, user_is_owner_if_in_sales
+
+    def decide(username, user, action, order):
+        actor = User(username=username, org=user["org"], role=user["role"])
+        if not has_permission(actor, _rbac_name(action)):
+            return False
+        # Listing doesn't filter by org (TODO(2) in app_abstracted.py).
+        if action in ("create_order", "view_order"):
+            return True
+        if not has_same_org(actor, order):
+            return False
+        if action == "cancel_order":
+            return user_is_owner_if_in_sales(actor, order)
+        return True
+
+    return decide
+
+
+# The app_decorated route that guards each action.
+DECORATED_ROUTES = {
+    "view_order": "list_orders",
+    "create_order": "create_order",
+    "fulfill_order": "fulfill_order",
+    "cancel_order": "cancel_order",
+    "delete_order": "delete_order",
+}
+
+
+def authz_decorators_impl() -> Decide:
+    from app_decorated import app
+
+    # The requirements each route's guard was compiled from, in the order it
+    # checks them.
+    requirements = {
+        action: sorted(
+            getattr(app.view_functions[endpoint], "__authz_requirements__", ()),
+            key=lambda requirement: requirement.cost,
+        )
+        for action, endpoint in DECORATED_ROUTES.items()
+    }
+
+    def decide(username, user, action, order):
+        actor = User(username=username, org=user["org"], role=user["role"])
+        order_id = order["id"] if order else None
+        return all(
+            requirement.check(actor, order_id, order) for requirement in requirements[action]
+        )
+
+    return decide
+
+
+def rbac_impl() -> Decide:
+    from permissions import RBAC
+
+    granted = {role: {p.value for p in permissions} for role, permissions in RBAC.items()}
+
+    def decide(username, user, action, order):
+        return _rbac_name(action) in granted.get(user["role"], ())
+
+    return decide
+
+
+def permission_view_impl() -> Decide:
+    from order_policy import order_permissions
+
+    def decide(username, user, action, order):
+        if action == "create_order":
+            return None
+        return action in order_permissions(username, user, order)
+
+    return decide
+
+
+def oso_impl(users: Dict[str, dict], orders: Dict[str, dict], url: Optional[str]) -> Decide:
+    from oso_cloud import Value
+
+    if url:
+        from oso_cloud import Oso
+
+        from authz_oso import OSO_API_KEY
+
+        oso = Oso(url=url, api_key=OSO_API_KEY)
+    else:
+        from oso_local import LocalOso
+
+        oso = LocalOso()
+        oso.policy(Path(__file__).with_name("policy.polar").read_text())
+
+    facts = [
+        ("has_role", Value("User", username), user["role"], Value("Organization", user["org"]))
+        for username, user in users.items()
+    ]
+    for order in orders.values():
+        order_value = Value("Order", order["id"])
+        facts.append(("has_relation", order_value, "org", Value("Organization", order["org"])))
+        facts.append(("has_relation", order_value, "sold_by", Value("User", order["sold_by"])))
+    with oso.batch() as tx:
+        for fact in facts:
+            tx.insert(fact)
+
+    def decide(username, user, action, order):
+        actor = Value("User", username)
+        if action == "create_order":
+            return oso.authorize(actor, action, Value("Organization", user["org"]))
+        return oso.authorize(actor, action, Value("Order", order["id"]))
+
+    return decide
+
+
+def build_cases(users: Dict[str, dict], orders: Dict[str, dict]) -> List[Case]:
+    cases: List[Case] = []
+    for username, user in sorted(users.items()):
+        cases.append((username, user, "create_order", None))
+        for order in orders.values():
+            for action in ACTIONS:
+                if action != "create_order":
+                    cases.append((username, user, action, order))
+    return cases
+
+
+def relation(username: str, user: dict, order: Optional[dict]) -> str:
+    if order is None:
+        return "own org"
+    org = "own org" if order["org"] == user["org"] else "other org"
+    return f"{org}, seller" if order["sold_by"] == username else org
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--users", type=int, default=0, help="generate this many users (default: data.USERS)"
+    )
+    parser.add_argument("--orgs", type=int, default=3, help="orgs to spread generated users over")
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--skew", type=float, default=1.0, help="tenant size skew")
+    parser.add_argument(
+        "--foreign-sellers",
+        type=float,
+        default=0.05,
+        help="share of orders whose seller is in another org (e.g. moved since)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--implementations", default=",".join(IMPLEMENTATIONS))
+    parser.add_argument("--oso-url", help="use this Oso server instead of the local stand-in")
+    parser.add_argument("--json", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    users = USERS
+    if args.users:
+        users = datagen.generate_users(args.orgs, args.users, args.skew, args.seed)
+    orders = datagen.generate_orders(users, args.orders, args.skew, args.seed)
+    rng = random.Random(args.seed)
+    usernames = sorted(users)
+    for order in orders.values():
+        if rng.random() < args.foreign_sellers:
+            others = [u for u in usernames if users[u]["org"] != order["org"]]
+            if others:
+                order["sold_by"] = rng.choice(others)
+
+    factories: Dict[str, Callable[[], Decide]] = {
+        "authz": authz_impl,
+        "authz_decorators": authz_decorators_impl,
+        "rbac": rbac_impl,
+        "permission_view": permission_view_impl,
+        "oso": lambda: oso_impl(users, orders, args.oso_url),
+    }
+    names = args.implementations.split(",")
+    cases = build_cases(users, orders)
+
+    results: Dict[str, List[Optional[bool]]] = {}
+    timings: Dict[str, float] = {}
+    print(f"{'implementation':<20}{'decisions':>12}{'allowed':>10}{'us/decision':>14}")
+    for name in names:
+        decide = factories[name]()
+        start = time.perf_counter()
+        answers = [decide(*case) for case in cases]
+        elapsed = time.perf_counter() - start
+        answered = [answer for answer in answers if answer is not None]
+        results[name], timings[name] = answers, elapsed / max(len(answered), 1)
+        print(
+            f"{name:<20}{len(answered):>12}{sum(answered):>10}{timings[name] * 1e6:>14.2f}"
+        )
+
+    # Disagreements, grouped by what decides them: action, role and how the
+    # user relates to the order.
+    groups: Dict[Tuple, dict] = {}
+    for i, (username, user, action, order) in enumerate(cases):
+        answers = {name: results[name][i] for name in names if results[name][i] is not None}
+        if len(set(answers.values())) <= 1:
+            continue
+        allowed = tuple(sorted(name for name, answer in answers.items() if answer))
+        denied = tuple(sorted(name for name, answer in answers.items() if not answer))
+        key = (action, user["role"], relation(username, user, order), allowed, denied)
+        group = groups.setdefault(
+            key, {"count": 0, "example": {"user": username, "order": order and order["id"]}}
+        )
+        group["count"] += 1
+
+    print()
+    if not groups:
+        print("All implementations agree.")
+    for (action, role, rel, allowed, denied), group in sorted(groups.items()):
+        example = group["example"]["user"]
+        if group["example"]["order"] is not None:
+            example += f" on order {group['example']['order']}"
+        print(
+            f"{action} by {role} ({rel}): {group['count']} decisions, "
+            f"allowed by {', '.join(allowed)}; denied by {', '.join(denied)} (e.g. {example})"
+        )
+
+    if args.json:
+        report = {
+            "decisions": len(cases),
+            "seconds_per_decision": timings,
+            "disagreements": [
+                {
+                    "action": action,
+                    "role": role,
+                    "relation": rel,
+                    "allowed_by": list(allowed),
+                    "denied_by": list(denied),
+                    **group,
+                }
+                for (action, role, rel, allowed, denied), group in sorted(groups.items())
+            ],
+        }
+        Path(args.json).write_text(json.dumps(report, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
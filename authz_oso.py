@@ -1,33 +1,115 @@
-from flask import jsonify, request
-from functools import wraps
+import hashlib
+import logging
+import os
+import threading
 from pathlib import Path
+from typing import Optional
+
+from authz_decorators import REMOTE_COST, Requirement, authorize
+from fact_sync import FactSync
 from order_service import OrderService
 from oso_cloud import Oso, Value
+from startup import on_warm_up
 
-# Instantiate the Oso Cloud client
-oso = Oso(
-    url="http://localhost:8080",
-     api_key="e_0123456789_12345_osotesttoken01xiIn",
-)
+OSO_URL = "http://localhost:8080"
+OSO_API_KEY = "e_0123456789_12345_osotesttoken01xiIn"
 
-# Load the policy
-policy_contents = Path("policy.polar").read_text()
-oso.policy(policy_contents)
+# Keep Oso's facts in sync with the user directory and order store, so
+# authorize calls don't need context facts. Set OSO_CONTEXT_FACTS=1 to send
+# every fact with every call instead.
+SEND_CONTEXT_FACTS = bool(os.environ.get("OSO_CONTEXT_FACTS"))
 
-# Route decorator
-def authorize_order_action(action: str):
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            # Get the user and order objects to authorize the action against.
-            user = Value("User", request.user.username)
-            order = Value("Order", kwargs.get("order_id"))
+# The client is created on first use, in the process that uses it. A client
+# (and its HTTP session and fact sync timer) inherited across a fork is
+# replaced rather than shared.
+_oso = None
+_fact_sync = None
+_oso_pid = None
+_lock = threading.Lock()
+
+
+def _create_client():
+    # Set OSO_LOCAL=1 to use the in-process stand-in from `oso_local` instead
+    # of a running Oso server.
+    if os.environ.get("OSO_LOCAL"):
+        from oso_local import LocalOso
+
+        return LocalOso()
+    return Oso(url=OSO_URL, api_key=OSO_API_KEY)
+
+
+def _server_policy(client) -> Optional[str]:
+    """The source of the policy the server is running, or None if it has none
+    or can't tell us."""
+    try:
+        policy = client.api.get_policy().policy
+    except Exception:
+        logging.warning("Couldn't read the policy from Oso", exc_info=True)
+        return None
+    if isinstance(policy, dict):
+        return policy.get("src")
+    return getattr(policy, "src", None)
+
+
+def push_policy(client, path: str = "policy.polar") -> bool:
+    """Push the policy unless the server is already running this version, so
+    restarts and new workers don't push an unchanged policy again. Returns
+    whether it was pushed."""
+    policy_contents = Path(path).read_text()
+    digest = hashlib.sha256(policy_contents.encode()).hexdigest()
+
+    # The in-process stand-in has no API to ask and starts empty every time,
+    # so always push to it.
+    if hasattr(client, "api"):
+        current = _server_policy(client)
+        if current is not None and hashlib.sha256(current.encode()).hexdigest() == digest:
+            logging.debug("Policy %s already active on %s", digest[:12], client.api.url)
+            return False
 
-            if not oso.authorize(user, action, order, OrderService.get_facts()):
-                return jsonify({"error": f"Permission denied for {action}"}), 403
+    client.policy(policy_contents)
+    logging.info("Pushed policy %s", digest[:12])
+    return True
 
-            return f(*args, **kwargs)
 
-        return decorated_function
+@on_warm_up
+def get_oso():
+    global _oso, _fact_sync, _oso_pid
+    if _oso is not None and _oso_pid == os.getpid():
+        return _oso
 
-    return decorator
+    with _lock:
+        if _oso is None or _oso_pid != os.getpid():
+            if _fact_sync is not None:
+                _fact_sync.stop()
+
+            client = _create_client()
+            push_policy(client)
+            fact_sync = FactSync(client)
+            if not SEND_CONTEXT_FACTS:
+                fact_sync.start()
+            _oso, _fact_sync, _oso_pid = client, fact_sync, os.getpid()
+    return _oso
+
+
+def is_order_action_allowed(user, action: str, order_id) -> bool:
+    # Get the user and order objects to authorize the action against.
+    actor = Value("User", user.username)
+    order = Value("Order", order_id)
+
+    if SEND_CONTEXT_FACTS:
+        return get_oso().authorize(actor, action, order, OrderService.get_facts())
+    return get_oso().authorize(actor, action, order)
+
+
+def order_action(action: str) -> Requirement:
+    return Requirement(
+        name=action,
+        cost=REMOTE_COST,
+        check=lambda user, order_id, order: is_order_action_allowed(user, action, order_id),
+        error=lambda user: f"Permission denied for {action}",
+    )
+
+
+# Route decorator
+def authorize_order_action(action: str):
+    return authorize(order_action(action))
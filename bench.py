@@ -0,0 +1,250 @@
+"""Benchmark the app variants against synthetic order datasets.
+
+Datasets come from `datagen`, over `data.USERS` or a generated user directory.
+Each variant runs in a fresh subprocess of its own, so its peak RSS is its own,
+and is driven in-process through the Flask test client with a
+list/create/fulfill/cancel mix, each request made by a user whose role would
+make it. `app_oso.py` runs against the in-process stand-in from `oso_local`,
+so no Oso server is needed.
+
+    python bench.py --orders 1000,10000 --requests 500
+    python bench.py --orders 1000 --save-baseline bench_baseline.json
+    python bench.py --orders 1000 --baseline bench_baseline.json
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import datagen
+from data import USERS
+
+REPO_DIR = Path(__file__).resolve().parent
+
+# `app.py` is the commented-out original and doesn't define an app.
+VARIANTS = ["app_hardcoded", "app_abstracted", "app_decorated", "app_oso"]
+
+# Share of each request type in the workload.
+REQUEST_MIX = [("list", 0.55), ("create", 0.15), ("fulfill", 0.15), ("cancel", 0.15)]
+# Who makes each request: anyone lists, sales create and cancel their own
+# orders, the warehouse fulfills orders of its org.
+ACTOR_ROLES = {"list": None, "create": "sales", "fulfill": "warehouse", "cancel": "sales"}
+
+
+def user_headers(users: Dict[str, dict], username: str) -> Dict[str, str]:
+    user = users[username]
+    return {
+        "X-User-Username": username,
+        "X-User-Role": user["role"],
+        "X-User-Org": user["org"],
+    }
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_variant(variant: str, users: Dict[str, dict], requests: int, seed: int) -> Dict[str, float]:
+    """Drive `variant` against ./orders.json. Runs in the subprocess started
+    by `run_in_subprocess`."""
+    # Imported late: the user directory is loaded from USER_DIRECTORY on import.
+    from order_service import OrderService
+
+    module = importlib.import_module(variant)
+    # The apps log at DEBUG through RichHandler; that would dominate timings.
+    logging.disable(logging.CRITICAL)
+    client = module.app.test_client()
+
+    rng = random.Random(seed)
+    kinds, weights = zip(*REQUEST_MIX)
+    usernames = sorted(users)
+    by_role: Dict[str, List[str]] = {}
+    for username in usernames:
+        by_role.setdefault(users[username]["role"], []).append(username)
+    orders_by_org: Dict[str, List[str]] = {}
+    orders_by_seller: Dict[str, List[str]] = {}
+    for org in OrderService.orgs():
+        for order_id, order in OrderService.org_snapshot(org).items():
+            orders_by_org.setdefault(org, []).append(order_id)
+            orders_by_seller.setdefault(order["sold_by"], []).append(order_id)
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    started = time.perf_counter()
+    for _ in range(requests):
+        kind = rng.choices(kinds, weights)[0]
+        role = ACTOR_ROLES[kind]
+        username = rng.choice(by_role.get(role, usernames) if role else usernames)
+        headers = user_headers(users, username)
+        if kind == "cancel":
+            candidates = orders_by_seller.get(username)
+        else:
+            candidates = orders_by_org.get(users[username]["org"])
+
+        start = time.perf_counter()
+        if kind == "list" or (kind != "create" and not candidates):
+            response = client.get("/orders", headers=headers)
+        elif kind == "create":
+            response = client.post(
+                "/orders",
+                headers=headers,
+                json={
+                    "customer": rng.choice(datagen.CUSTOMERS),
+                    "items": [rng.choice(datagen.ITEMS)],
+                },
+            )
+            if response.status_code == 201:
+                order_id = response.get_json()["id"]
+                orders_by_org.setdefault(users[username]["org"], []).append(order_id)
+                orders_by_seller.setdefault(username, []).append(order_id)
+        else:
+            response = client.post(f"/orders/{rng.choice(candidates)}/{kind}", headers=headers)
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    elapsed = time.perf_counter() - started
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rps": requests / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": sum(count for status, count in statuses.items() if status >= 500),
+        # Denied or invalid; a realistic mix should have next to none.
+        "rejected": sum(count for status, count in statuses.items() if 400 <= status < 500),
+    }
+
+
+def run_in_subprocess(
+    variant: str, dataset: Path, workdir: Path, requests: int, seed: int
+) -> Dict[str, float]:
+    """Run `variant` over `dataset` in a new process, with its own copy of the
+    store and shared cache under `workdir`."""
+    rundir = workdir / f"{variant}-{dataset.stem}"
+    rundir.mkdir()
+    shutil.copy(REPO_DIR / "policy.polar", rundir)
+    shutil.copy(REPO_DIR / "orders_backup.json", rundir)
+    shutil.copy(dataset, rundir / "orders.json")
+
+    command = [sys.executable, str(REPO_DIR / "bench.py"), "--run-variant", variant]
+    command += ["--requests", str(requests), "--seed", str(seed)]
+    env = {**os.environ, "SHARED_CACHE_DIR": str(rundir)}
+    process = subprocess.run(command, cwd=rundir, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"{variant} failed:\n{process.stderr}")
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def compare(
+    results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float
+) -> List[Tuple[str, str, float, float]]:
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]
+        if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append((key, "p99_ms", before["p99_ms"], result["p99_ms"]))
+        if result["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append((key, "rps", before["rps"], result["rps"]))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", default="1000", help="comma-separated dataset sizes")
+    parser.add_argument("--requests", type=int, default=500, help="requests per variant")
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument(
+        "--users", type=int, default=0, help="generate this many users (default: data.USERS)"
+    )
+    parser.add_argument("--orgs", type=int, default=10, help="orgs to spread generated users over")
+    parser.add_argument("--skew", type=float, default=1.0, help="tenant size skew")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="baseline JSON to check for regressions")
+    parser.add_argument("--save-baseline", help="write results to this JSON file")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed slowdown before flagging"
+    )
+    parser.add_argument("--run-variant", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OSO_LOCAL", "1")
+    # Measure the apps, not the rate limits in front of them.
+    os.environ.setdefault("ADMISSION_CONTROL", "0")
+
+    if args.run_variant:
+        sys.path.insert(0, str(REPO_DIR))
+        users = USERS
+        if os.environ.get("USER_DIRECTORY"):
+            users = json.loads(Path(os.environ["USER_DIRECTORY"]).read_text())
+        result = run_variant(args.run_variant, users, args.requests, args.seed)
+        print(json.dumps(result))
+        return 0
+
+    sizes = [int(size) for size in args.orders.split(",")]
+    variants = args.variants.split(",")
+
+    # Each variant runs in a subdirectory of a scratch directory, with its own
+    # ./orders.json and shared cache files, all removed at the end.
+    workdir = Path(tempfile.mkdtemp(prefix="oso-bench-"))
+
+    users = USERS
+    if args.users:
+        users = datagen.generate_users(args.orgs, args.users, args.skew, args.seed)
+        (workdir / "users.json").write_text(json.dumps(users))
+        os.environ["USER_DIRECTORY"] = str(workdir / "users.json")
+
+    results: Dict[str, dict] = {}
+    try:
+        print(f"{'variant':<16}{'orders':>10}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'rss MB':>10}")
+        for size in sizes:
+            dataset = workdir / f"orders-{size}.json"
+            orders = datagen.generate_orders(users, size, args.skew, args.seed)
+            dataset.write_text(json.dumps(orders))
+            del orders
+            for variant in variants:
+                result = run_in_subprocess(variant, dataset, workdir, args.requests, args.seed)
+                results[f"{variant}@{size}"] = result
+                notes = [
+                    f"{result[name]} {name}" for name in ("errors", "rejected") if result.get(name)
+                ]
+                print(
+                    f"{variant:<16}{size:>10}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                    f"{result['rps']:>10.1f}{result['peak_rss_mb']:>10.1f}"
+                    + (f"  ({', '.join(notes)})" if notes else "")
+                )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(results, indent=4, sort_keys=True))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        for key, metric, before, after in regressions:
+            print(f"REGRESSION {key} {metric}: {before:.2f} -> {after:.2f}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
+from typing import Optional
 
 # Hardcoded users and their roles
 # TODO(1): Scale the app to include Zombo users. You'll see their data is
@@ -30,10 +31,12 @@ class Order:
     customer: str
     items: list
     status: str
+    # When the order was fulfilled or cancelled (seconds since the epoch).
+    closed_at: Optional[float] = None
 
 @dataclass
 class OrderWithPermissions(Order):
-    permissions: list
+    permissions: list = field(default_factory=list)
 
 class OrderStatus(Enum):
     PENDING = "pending"
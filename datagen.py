@@ -0,0 +1,102 @@
+"""Generate deterministic multi-tenant users and orders for tests and benchmarks.
+
+Org sizes follow a Zipf-like distribution controlled by `skew`: 0 spreads
+users and orders evenly, larger values concentrate them in the first orgs.
+
+    python datagen.py --orgs 1000 --users 200000 --orders 1000000 \\
+        --users-out users-1m.db --orders-out orders-1m.json
+
+Both output paths are required, so the demo's own orders.json is only ever
+overwritten on purpose.
+"""
+
+import argparse
+import json
+import random
+from itertools import accumulate
+from typing import Dict, List
+
+ROLE_MIX = [("sales", 0.6), ("warehouse", 0.3), ("admin", 0.1)]
+CUSTOMERS = ["W. Coyote", "R. Runner", "Ross + Rachel Corp", "E. Fudd", "Y. Sam"]
+ITEMS = ["anvil", "sign", "latte", "rocket", "magnet", "birdseed", "tnt"]
+
+
+def org_weights(orgs: int, skew: float) -> List[float]:
+    return [1 / (rank ** skew) for rank in range(1, orgs + 1)]
+
+
+def generate_users(orgs: int, users: int, skew: float = 1.0, seed: int = 0) -> Dict[str, dict]:
+    rng = random.Random(seed)
+    org_names = [f"Org{i}" for i in range(orgs)]
+    roles, role_weights = zip(*ROLE_MIX)
+
+    # Every org gets one user of each role so it can list, create and fulfill.
+    assignments = [org for org in org_names for _ in roles]
+    cum_weights = list(accumulate(org_weights(orgs, skew)))
+    assignments += rng.choices(
+        org_names, cum_weights=cum_weights, k=max(0, users - len(assignments))
+    )
+
+    directory = {}
+    counts: Dict[str, int] = {}
+    for i, org in enumerate(assignments):
+        if i < orgs * len(roles):
+            role = roles[i % len(roles)]
+        else:
+            role = rng.choices(roles, role_weights)[0]
+        counts[org] = counts.get(org, 0) + 1
+        directory[f"{org}User{counts[org]}"] = {"org": org, "role": role}
+    return directory
+
+
+def generate_orders(
+    users: Dict[str, dict], count: int, skew: float = 1.0, seed: int = 0
+) -> Dict[str, dict]:
+    rng = random.Random(seed)
+    sellers: Dict[str, List[str]] = {}
+    for username, user in sorted(users.items()):
+        if user["role"] == "sales":
+            sellers.setdefault(user["org"], []).append(username)
+
+    orgs = sorted(sellers)
+    cum_weights = list(accumulate(org_weights(len(orgs), skew)))
+
+    orders = {}
+    for i, org in enumerate(rng.choices(orgs, cum_weights=cum_weights, k=count), start=1):
+        orders[str(i)] = {
+            "id": str(i),
+            "org": org,
+            "sold_by": rng.choice(sellers[org]),
+            "customer": rng.choice(CUSTOMERS),
+            "items": rng.sample(ITEMS, rng.randint(1, 3)),
+            "status": "pending",
+        }
+    return orders
+
+
+def main() -> None:
+    from user_directory import UserDirectory
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orgs", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--users-out", required=True, help=".json or .db/.sqlite")
+    parser.add_argument("--orders-out", required=True)
+    args = parser.parse_args()
+
+    users = generate_users(args.orgs, args.users, args.skew, args.seed)
+    if args.users_out.endswith((".db", ".sqlite", ".sqlite3")):
+        UserDirectory(users).to_sqlite(args.users_out)
+    else:
+        with open(args.users_out, "w") as f:
+            json.dump(users, f, indent=4)
+
+    with open(args.orders_out, "w") as f:
+        json.dump(generate_orders(users, args.orders, args.skew, args.seed), f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+from typing import Iterable, List, Optional, Set, Tuple
+
+from oso_cloud import Value, ValueOfType
+from oso_cloud.helpers import from_api_fact, to_api_fact
+
+import metrics
+from order_service import OrderChanges, OrderService
+from user_directory import directory
+
+# Centralized authorization data
+#
+# Keeps Oso's fact store in step with the user directory and the order store,
+# so authorize calls don't need to carry context facts. Each order write sends
+# only the facts of the orders it changed, and each directory change only that
+# user's roles, in batches. A periodic full reconcile compares against what the
+# server actually holds, to repair anything a failed or concurrent sync missed.
+#
+# The reconcile treats every fact matching SYNCED_FACT_PATTERNS as this app's:
+# users' roles in organizations and orders' org and sold_by relations. Facts
+# of those shapes written by anything else are deleted, so don't share them
+# with another app in the same Oso environment.
+
+Fact = Tuple
+
+BATCH_SIZE = int(os.environ.get("FACT_SYNC_BATCH_SIZE", "1000"))
+RECONCILE_SECONDS = float(os.environ.get("FACT_SYNC_RECONCILE_SECONDS", "300"))
+
+# The fact shapes this module owns on the server.
+SYNCED_FACT_PATTERNS = [
+    ("has_role", ValueOfType("User"), None, ValueOfType("Organization")),
+    ("has_relation", ValueOfType("Order"), "org", ValueOfType("Organization")),
+    ("has_relation", ValueOfType("Order"), "sold_by", ValueOfType("User")),
+]
+
+FACTS_PUSHED = metrics.Counter(
+    "fact_sync_facts_total", "Facts pushed to Oso by the fact sync.", ("op",)
+)
+
+
+def _canonical(fact: Fact) -> Fact:
+    # The server hands every argument back as a Value with a string id, e.g. a
+    # role as Value("String", "admin"); put ours in the same shape so the two
+    # compare equal.
+    return from_api_fact(to_api_fact(fact))
+
+
+def _desired() -> Set[Fact]:
+    return {_canonical(fact) for fact in OrderService.get_facts()}
+
+
+def _order_facts(order: Optional[dict]) -> Set[Fact]:
+    if order is None:
+        return set()
+    return {_canonical(fact) for fact in OrderService.order_facts({order["id"]: order})}
+
+
+def _user_facts(username: str) -> Set[Fact]:
+    user = Value("User", username)
+    return {_canonical(fact) for fact in OrderService.user_facts() if fact[1] == user}
+
+
+def _chunks(facts: List[Fact], size: int) -> Iterable[List[Fact]]:
+    for i in range(0, len(facts), size):
+        yield facts[i : i + size]
+
+
+class FactSync:
+    def __init__(self, oso, batch_size: int = BATCH_SIZE):
+        self.oso = oso
+        self.batch_size = batch_size
+        self._synced: Set[Fact] = set()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._stopped = threading.Event()
+
+    def sync(self, changes: OrderChanges = None) -> Tuple[int, int]:
+        """Push the facts of the orders in `changes`, or with None (a bulk
+        write) the difference between all current facts and the last synced
+        state. Returns the number of facts inserted and deleted.
+
+        Used as an `OrderService` listener."""
+        with self._lock:
+            if changes is None:
+                desired = _desired()
+                inserts, deletes = desired - self._synced, self._synced - desired
+            else:
+                inserts, deletes = set(), set()
+                # Applied in order, so an order changed twice in one write
+                # ends up with the facts of its last version.
+                for old, new in changes:
+                    old_facts, new_facts = _order_facts(old), _order_facts(new)
+                    added, removed = new_facts - old_facts, old_facts - new_facts
+                    inserts = (inserts - removed) | added
+                    deletes = (deletes - added) | removed
+            return self._apply(inserts, deletes)
+
+    def sync_user(self, username: str) -> Tuple[int, int]:
+        """Push `username`'s roles. Used as a `directory` listener."""
+        with self._lock:
+            synced = {
+                fact
+                for fact in self._synced
+                if fact[0] == "has_role" and fact[1] == Value("User", username)
+            }
+            desired = _user_facts(username)
+            return self._apply(desired - synced, synced - desired)
+
+    def _apply(self, inserts: Set[Fact], deletes: Set[Fact]) -> Tuple[int, int]:
+        # Skip what a reconcile running since the write already pushed.
+        inserts, deletes = inserts - self._synced, deletes & self._synced
+        inserted, deleted = self._push(inserts, deletes)
+        self._synced = (self._synced - deletes) | inserts
+        return inserted, deleted
+
+    def reconcile(self) -> Tuple[int, int]:
+        """Diff against the facts the server holds rather than our own record
+        of what was pushed."""
+        with self._lock:
+            desired = _desired()
+            held: Set[Fact] = set()
+            for pattern in SYNCED_FACT_PATTERNS:
+                held.update(_canonical(fact) for fact in self.oso.get(pattern))
+            inserted, deleted = self._push(desired - held, held - desired)
+            self._synced = desired
+        if inserted or deleted:
+            logging.info("Fact reconcile pushed %d inserts, %d deletes", inserted, deleted)
+        return inserted, deleted
+
+    def _push(self, inserts: Set[Fact], deletes: Set[Fact]) -> Tuple[int, int]:
+        inserts, deletes = list(inserts), list(deletes)
+        # Inserts first, so a sync that is cut short leaves stale grants behind
+        # (which the next reconcile removes) rather than denying everyone.
+        for chunk in _chunks(inserts, self.batch_size):
+            with self.oso.batch() as tx:
+                for fact in chunk:
+                    tx.insert(fact)
+        for chunk in _chunks(deletes, self.batch_size):
+            with self.oso.batch() as tx:
+                for fact in chunk:
+                    tx.delete(fact)
+
+        FACTS_PUSHED.inc("insert", amount=len(inserts))
+        FACTS_PUSHED.inc("delete", amount=len(deletes))
+        return len(inserts), len(deletes)
+
+    # Lifecycle
+    def start(self, reconcile_seconds: float = RECONCILE_SECONDS) -> None:
+        """Do a full reconcile, sync on every order write from now on and
+        reconcile again every `reconcile_seconds`."""
+        self._stopped.clear()
+        self.reconcile()
+        OrderService.listeners.append(self.sync)
+        directory.listeners.append(self.sync_user)
+        if reconcile_seconds > 0:
+            self._schedule(reconcile_seconds)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self.sync in OrderService.listeners:
+            OrderService.listeners.remove(self.sync)
+        if self.sync_user in directory.listeners:
+            directory.listeners.remove(self.sync_user)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule(self, interval: float) -> None:
+        def run():
+            if self._stopped.is_set():
+                return
+            try:
+                self.reconcile()
+            except Exception:
+                logging.exception("Fact reconcile failed")
+            self._schedule(interval)
+
+        self._timer = threading.Timer(interval, run)
+        self._timer.daemon = True
+        self._timer.start()
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+from flask import Flask, Response, g, jsonify, request
+
+import metrics
+
+# Idempotency keys for mutation routes
+#
+# A client that sends `Idempotency-Key` on a POST or DELETE can safely retry it:
+# the first response for that key is kept, and a retry gets it back straight
+# from the `before_request` hook, without authorization or `OrderService` ever
+# seeing the request. A retry that arrives while the first request is still
+# running waits for it. Keys are per user and per route, and reusing one with a
+# different request (body, query string, or the Accept and Prefer headers that
+# shape the response) is an error.
+#
+# Responses are kept in memory, per worker: the most recent MAX_KEYS, for at
+# most TTL_SECONDS. Server errors and other transient rejections (e.g. a 429
+# from admission control) aren't kept, so those can be retried for real.
+#
+# Only retries that reach the same worker process are deduplicated; one that
+# lands on another worker runs again. Run a single worker, or have the load
+# balancer route on the Idempotency-Key header, where that matters.
+
+HEADER = "Idempotency-Key"
+METHODS = ("POST", "DELETE")
+
+MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "10000"))
+TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# How long a retry waits for the original request before giving up.
+WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "30"))
+
+Key = Tuple[str, str, str, str]
+
+# Responses that say "not now" rather than answering the request.
+TRANSIENT_STATUSES = (408, 425, 429)
+# Request headers that change what the response looks like.
+FINGERPRINT_HEADERS = ("Accept", "Prefer")
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    created: float = field(default_factory=time.monotonic)
+    done: threading.Event = field(default_factory=threading.Event)
+    # (status, body, headers) once the original request finished.
+    response: Optional[Tuple[int, bytes, list]] = None
+
+
+class IdempotencyStore:
+    def __init__(self, max_keys: int = MAX_KEYS, ttl: float = TTL_SECONDS):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Key, _Entry]" = OrderedDict()
+
+    def begin(self, key: Key, fingerprint: str) -> Tuple[_Entry, bool]:
+        """The entry for `key`, and whether this caller owns it (must run the
+        request and then `finish` or `abandon` it)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.created > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                return entry, False
+
+            entry = self._entries[key] = _Entry(fingerprint)
+            while len(self._entries) > self.max_keys:
+                # In-flight entries are evicted too; their waiters still get
+                # woken when they finish.
+                self._entries.popitem(last=False)
+            return entry, True
+
+    def finish(self, entry: _Entry, response: Response) -> None:
+        headers = [(k, v) for k, v in response.headers if k.lower() != "content-length"]
+        entry.response = (response.status_code, response.get_data(), headers)
+        entry.done.set()
+
+    def abandon(self, key: Key, entry: _Entry) -> None:
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+
+store = IdempotencyStore()
+
+
+def _replay(entry: _Entry) -> Response:
+    status, body, headers = entry.response
+    response = Response(body, status=status, headers=headers)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _fingerprint() -> str:
+    digest = hashlib.sha256()
+    for part in (
+        request.query_string,
+        *(request.headers.get(name, "").encode() for name in FINGERPRINT_HEADERS),
+    ):
+        # Length-prefixed, so parts can't run into each other.
+        digest.update(len(part).to_bytes(8, "big") + part)
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def before_request():
+    key_header = request.headers.get(HEADER)
+    if not key_header or request.method not in METHODS:
+        return None
+
+    key = (request.headers.get("X-User-Username", ""), request.method, request.path, key_header)
+    fingerprint = _fingerprint()
+    while True:
+        entry, owner = store.begin(key, fingerprint)
+        if owner:
+            g.idempotency = (key, entry)
+            metrics.record_cache("idempotency", False)
+            return None
+
+        if entry.fingerprint != fingerprint:
+            return jsonify({"error": f"{HEADER} was already used for a different request"}), 422
+        if not entry.done.wait(WAIT_SECONDS):
+            return jsonify({"error": f"A request with this {HEADER} is still in progress"}), 409
+        if entry.response is not None:
+            metrics.record_cache("idempotency", True)
+            return _replay(entry)
+        # The original request failed and was dropped; take over from it.
+
+
+def after_request(response: Response) -> Response:
+    pending = g.pop("idempotency", None)
+    if pending is not None:
+        key, entry = pending
+        if response.status_code >= 500 or response.status_code in TRANSIENT_STATUSES:
+            store.abandon(key, entry)
+        else:
+            store.finish(entry, response)
+    return response
+
+
+def teardown_request(exc=None) -> None:
+    # Reached with the entry still pending only if the request raised.
+    pending = g.pop("idempotency", None)
+    if pending is not None:
+        store.abandon(*pending)
+
+
+def init_app(app: Flask) -> None:
+    # Registered before any other hooks, so replays skip them all.
+    app.before_request_funcs.setdefault(None, []).insert(0, before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import random
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+from flask import Flask, Response
+
+# In-process instrumentation, exposed in Prometheus text format on /metrics.
+#
+# Metrics live in this module for the lifetime of the process; each worker
+# reports its own numbers, the way a Prometheus client library would without a
+# multiprocess collector.
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Fraction of authorization decisions written to the decision log.
+DECISION_LOG_SAMPLE_RATE = float(os.environ.get("AUTHZ_DECISION_LOG_SAMPLE_RATE", "0.01"))
+
+decision_log = logging.getLogger("authz.decisions")
+
+_lock = threading.Lock()
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        # Copied under the lock: inc() may add a label set meanwhile.
+        with _lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # Per label set: [per-bucket counts..., +Inf count], sum
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with _lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        # Copied under the lock: observe() adds label sets and bumps counts.
+        with _lock:
+            values = {labels: (list(counts), total) for labels, (counts, total)
+                      in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labels + ("le",), labels + (str(bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_str = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_str} {total}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+# Authorization
+AUTHZ_SECONDS = Histogram(
+    "authz_check_seconds",
+    "Time spent evaluating an authorization requirement.",
+    ("route", "action", "engine", "result"),
+)
+
+# Storage
+ORDER_STORE_SECONDS = Histogram(
+    "order_store_seconds", "Time spent reading or writing the order store.", ("op",)
+)
+ORDER_STORE_BYTES = Histogram(
+    "order_store_bytes", "Size of order store reads and writes.", ("op",), BYTES_BUCKETS
+)
+
+GROUP_COMMIT_SIZE = Histogram(
+    "order_group_commit_size",
+    "Mutations coalesced into one order store write.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+# Caches
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by cache and outcome.", ("cache", "result")
+)
+
+
+def record_authz(
+    route: str, action: str, engine: str, user, resource, allowed: bool, seconds: float
+) -> None:
+    result = "allow" if allowed else "deny"
+    AUTHZ_SECONDS.observe(seconds, route or "", action, engine, result)
+
+    if DECISION_LOG_SAMPLE_RATE and random.random() < DECISION_LOG_SAMPLE_RATE:
+        decision_log.info(
+            json.dumps(
+                {
+                    "user": getattr(user, "username", None),
+                    "action": action,
+                    "resource": resource,
+                    "result": result,
+                    "engine": engine,
+                    "route": route,
+                    "latency_ms": round(seconds * 1000, 3),
+                }
+            )
+        )
+
+
+def record_store(op: str, seconds: float, size: int) -> None:
+    ORDER_STORE_SECONDS.observe(seconds, op)
+    ORDER_STORE_BYTES.observe(size, op)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app: Flask) -> None:
+    @app.route("/metrics", methods=["GET"])
+    def prometheus_metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
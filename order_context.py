@@ -0,0 +1,75 @@
+import logging
+from typing import Dict, Optional
+
+from flask import Flask, Response, g, jsonify
+
+import metrics
+from order_service import OrderService
+
+# Request-scoped unit of work for orders.
+#
+# The first caller in a request that needs an order loads it; every authz
+# decorator and the route handler then share that copy. Changed and deleted
+# orders are recorded and written back once, just before the response is sent.
+
+
+def load_orders() -> Dict[str, dict]:
+    metrics.record_cache("request_orders", "orders" in g)
+    if "orders" not in g:
+        g.orders = OrderService.load_orders()
+        # Keep copies already handed out for single orders.
+        g.orders.update(g.get("loaded_orders", {}))
+    return g.orders
+
+
+def find_order(order_id: str) -> Optional[dict]:
+    if "orders" in g:
+        metrics.record_cache("request_orders", True)
+        return g.orders.get(order_id)
+
+    loaded = g.setdefault("loaded_orders", {})
+    metrics.record_cache("request_orders", order_id in loaded)
+    if order_id not in loaded:
+        try:
+            loaded[order_id] = OrderService.get_order(order_id)
+        except KeyError:
+            return None
+    return loaded[order_id]
+
+
+def get_order(order_id: str) -> dict:
+    order = find_order(order_id)
+    if order is None:
+        raise KeyError(order_id)
+    return order
+
+
+def delete_order(order_id: str) -> None:
+    g.setdefault("deleted_orders", set()).add(order_id)
+
+
+def flush(response: Response) -> Response:
+    """Carry out the request's deletes before the response goes out, so a
+    client is only told about a delete once it's stored."""
+    deleted = g.pop("deleted_orders", set())
+    # Don't persist half-applied changes from a request that failed.
+    if response.status_code >= 500:
+        return response
+    try:
+        for order_id in deleted:
+            OrderService.delete_order(order_id)
+    except Exception:
+        logging.exception("Failed to delete orders %s", sorted(deleted))
+        response = jsonify({"error": "Failed to save the order"})
+        response.status_code = 500
+    return response
+
+
+def release(exc=None) -> None:
+    for name in ("deleted_orders", "orders", "loaded_orders"):
+        g.pop(name, None)
+
+
+def init_app(app: Flask) -> None:
+    app.after_request(flush)
+    app.teardown_request(release)
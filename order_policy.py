@@ -0,0 +1,31 @@
+from typing import Optional, Set, Tuple
+
+# policy.polar's rules on orders, in Python
+#
+# The materialized permission view evaluates these per order, and the columnar
+# order table derives its role-to-permission matrix from them, so both follow
+# one copy of the rules. If you change `policy.polar`, change
+# `order_permissions` to match.
+
+ORDER_PERMISSIONS = ("view_order", "fulfill_order", "cancel_order", "delete_order")
+
+Permissions = Tuple[str, ...]
+
+
+def order_permissions(username: str, user: Optional[dict], order: dict) -> Permissions:
+    """The permissions `policy.polar` grants `username` on `order`."""
+    granted: Set[str] = set()
+    if user is not None and user["org"] == order["org"]:
+        # Admins have all permissions
+        if user["role"] == "admin":
+            granted.update(ORDER_PERMISSIONS)
+        # "view_order" if "member" on "org"
+        if user["role"] in ("warehouse", "sales", "admin"):
+            granted.add("view_order")
+        # "fulfill_order" if "warehouse" on "org"
+        if user["role"] == "warehouse":
+            granted.add("fulfill_order")
+    # "cancel_order" if "sold_by"
+    if order["sold_by"] == username:
+        granted.add("cancel_order")
+    return tuple(p for p in ORDER_PERMISSIONS if p in granted)
@@ -0,0 +1,77 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+# Inverted index over order text
+#
+# Maps each lowercased word of an order's `customer` and `items` (plus a
+# `status:<status>` term) to the ids of the orders containing it, so a search
+# intersects a few id sets instead of scanning every order. `OrderService`
+# keeps one index per org shard and patches it as its own writes land.
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> Set[str]:
+    return set(_WORD.findall(text.lower()))
+
+
+def order_terms(order: dict) -> Set[str]:
+    terms = tokenize(order["customer"])
+    for item in order["items"]:
+        terms |= tokenize(item)
+    terms.add(f"status:{order['status']}")
+    return terms
+
+
+def query_terms(query: str, status: Optional[str] = None) -> Set[str]:
+    terms = tokenize(query)
+    if status:
+        terms.add(f"status:{status.lower()}")
+    return terms
+
+
+class SearchIndex:
+    def __init__(self, generation: int):
+        # The shard generation this index reflects.
+        self.generation = generation
+        self._postings: Dict[str, Set[str]] = {}
+        self._terms: Dict[str, Set[str]] = {}
+
+    @classmethod
+    def build(cls, generation: int, orders: Dict[str, dict]) -> "SearchIndex":
+        index = cls(generation)
+        for order in orders.values():
+            index.add(order)
+        return index
+
+    def add(self, order: dict) -> None:
+        self.remove(order["id"])
+        terms = self._terms[order["id"]] = order_terms(order)
+        for term in terms:
+            self._postings.setdefault(term, set()).add(order["id"])
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        if old is not None:
+            self.remove(old["id"])
+        if new is not None:
+            self.add(new)
+
+    def remove(self, order_id: str) -> None:
+        for term in self._terms.pop(order_id, ()):
+            postings = self._postings[term]
+            postings.discard(order_id)
+            if not postings:
+                del self._postings[term]
+
+    def search(self, terms: Iterable[str]) -> List[str]:
+        """Ids of the orders containing every term."""
+        # Intersect starting from the rarest term.
+        postings = sorted((self._postings.get(term, set()) for term in terms), key=len)
+        if not postings:
+            return []
+        matches = set(postings[0])
+        for ids in postings[1:]:
+            matches &= ids
+            if not matches:
+                break
+        return list(matches)
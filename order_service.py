@@ -1,67 +1,853 @@
+import fcntl
+import functools
+import glob
+import gzip
 import json
-from typing import Dict
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Mapping
 import logging
-from data import USERS, Order, OrderStatus
-from typing import List, Tuple
+import metrics
+from data import Order, OrderStatus
+from order_search import SearchIndex, query_terms
+from order_stats import OrderStats
+from shared_cache import SharedCache, file_signature
+from startup import on_warm_up
+from user_directory import directory
+from work_queue import WorkQueue
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 from oso_cloud import Value
 
+# Orders are stored in one shard per org under ORDERS_DIR/shards, each with its
+# own file, lock, generation counter and shared cache. Shard file names are the
+# percent-encoded org name, so every org gets its own file and no org can clash
+# with the store's own files. Next to the shards are the list of
+# orgs, which only changes when an org gets its first order, and the next order
+# id. Which org an order belongs to is read from the shards themselves, so a
+# write only ever rewrites its own org's shard. The first time the store is
+# used it is seeded from orders.json.
+ORDERS_DIR = os.environ.get("ORDERS_DIR", "orders.d")
+LEGACY_ORDERS_PATH = "orders.json"
+ORGS_NAME = "_orgs.json"
+NEXT_ID_NAME = "_next_id.json"
+SHARDS_DIR = "shards"
+
+# (old, new) pairs describing a write; None when not known (bulk writes).
+OrderChanges = Optional[List[Tuple[Optional[dict], Optional[dict]]]]
+
+# Set ORDERS_FSYNC=0 to skip fsync on writes (e.g. for throwaway benchmarks).
+FSYNC = os.environ.get("ORDERS_FSYNC", "1") != "0"
+# How long the first writer to a shard waits for others to join its commit.
+GROUP_COMMIT_WINDOW = float(os.environ.get("ORDERS_GROUP_COMMIT_MS", "2")) / 1000
+
+# Fulfilled and cancelled orders never change again. Once closed for longer than
+# ORDERS_ARCHIVE_AFTER_SECONDS they move out of the shards into gzipped,
+# append-only segments under ORDERS_DIR/archive, one new segment per org per
+# archiving run. Each worker looks for orders to archive every
+# ORDERS_ARCHIVE_INTERVAL_SECONDS (0 to disable).
+ARCHIVE_DIR = "archive"
+ARCHIVE_STATE_NAME = os.path.join(ARCHIVE_DIR, "_state.json")
+ARCHIVE_AFTER_SECONDS = float(os.environ.get("ORDERS_ARCHIVE_AFTER_SECONDS", str(7 * 24 * 3600)))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get("ORDERS_ARCHIVE_INTERVAL_SECONDS", "3600"))
+TERMINAL_STATUSES = (OrderStatus.FULFILLED.value, OrderStatus.CANCELLED.value)
+
+# Processes used to parse shards at warm-up; 1 loads them in-process. Every
+# worker of a prefork server warms up on its own, so this is per worker: keep
+# it small there, raise it for a single-process server with many shards.
+LOAD_WORKERS = int(os.environ.get("ORDERS_LOAD_WORKERS", "2"))
+
+
+def _shard_filename(org: str) -> str:
+    # "." is encoded too, so the name never contains one before the suffix and
+    # archive segment names ("<name>.<ns>.jsonl.gz") stay unambiguous.
+    return urllib.parse.quote(org, safe="").replace(".", "%2E") + ".json"
+
+
+def _order_id_key(order_id: str):
+    return (0, int(order_id), "") if order_id.isdigit() else (1, 0, order_id)
+
+
+def _segment_prefix(org: str) -> str:
+    return _shard_filename(org)[: -len(".json")]
+
+
+def _segment_pattern(org: str) -> re.Pattern:
+    return re.compile(re.escape(_segment_prefix(org)) + r"\.\d+\.jsonl\.gz")
+
+
+def _max_order_id(order_ids) -> int:
+    return max((int(order_id) for order_id in order_ids if order_id.isdigit()), default=0)
+
+
+def _write_json(path: str, value) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _fsync_dir(path: str) -> None:
+    dir_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    generation: int
+    signature: Tuple[int, int]
+    value: Any
+
+
+class _JsonFile:
+    """A JSON document on disk, read through the shared cache."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.cache = SharedCache.for_path(path)
+        # The newest read-only version this process has parsed.
+        self._snapshot: Optional[_Snapshot] = None
+
+    def load(self, default):
+        try:
+            signature = file_signature(self.path)
+        except FileNotFoundError:
+            return default
+
+        value = self.cache.get(signature)
+        if value is not None:
+            return value
+
+        # Read the generation first: if a write lands while we parse, we
+        # publish under the older generation and nobody adopts it.
+        generation = self.cache.generation()
+        start = time.perf_counter()
+        with open(self.path, "rb") as f:
+            value = json.load(f)
+            metrics.record_store("load", time.perf_counter() - start, f.tell())
+        self.cache.put(value, generation, signature)
+        return value
+
+    def snapshot(self, default):
+        """A read-only view of the current contents.
+
+        Every reader of one version shares the same frozen copy, taken without
+        any lock. A reader keeps the version it got for as long as it holds a
+        reference, even while writers publish newer ones; a version nobody
+        references any more is simply garbage collected.
+        """
+        try:
+            signature = file_signature(self.path)
+        except FileNotFoundError:
+            return _freeze(default)
+
+        generation = self.cache.generation()
+        snapshot = self._snapshot
+        hit = snapshot is not None and (snapshot.generation, snapshot.signature) == (
+            generation,
+            signature,
+        )
+        metrics.record_cache("order_snapshots", hit)
+        if not hit:
+            # If a write lands meanwhile, this is labelled with the older
+            # generation and simply replaced on the next read.
+            snapshot = self._snapshot = _Snapshot(
+                generation, signature, _freeze(self.load(default))
+            )
+        return snapshot.value
+
+    def save(self, value) -> int:
+        """Write `value` and return the file's new generation."""
+        start = time.perf_counter()
+        contents = json.dumps(value, indent=4)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(contents)
+            if FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if FSYNC:
+            # Make the rename itself durable.
+            _fsync_dir(os.path.dirname(self.path))
+        metrics.record_store("save", time.perf_counter() - start, len(contents))
+
+        # Bump after the file is written, so a worker that sees the new
+        # generation can't read the old file.
+        generation = self.cache.bump()
+        self.cache.put(value, generation, file_signature(self.path))
+        return generation
+
+    @contextmanager
+    def lock(self):
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+
+@dataclass
+class _Mutation:
+    kind: str  # "create", "status" or "delete"
+    order_id: Optional[str] = None
+    value: Any = None
+    future: Future = None
+
+
+class _GroupCommit:
+    """Coalesces concurrent mutations of one shard into a single durable write.
+
+    The first writer to arrive becomes the leader: it waits GROUP_COMMIT_WINDOW
+    for others to queue up behind it, applies every queued mutation to one copy
+    of the shard, writes it once and then acknowledges them all. A mutation
+    only returns once the write that contains it is on disk.
+    """
+
+    def __init__(self, org: str, shard: _JsonFile):
+        self.org = org
+        self.shard = shard
+        self._lock = threading.Lock()
+        self._pending: List[_Mutation] = []
+        self._leader = False
+
+    def submit(self, mutation: _Mutation):
+        mutation.future = Future()
+        with self._lock:
+            self._pending.append(mutation)
+            lead = not self._leader
+            self._leader = True
+
+        if lead:
+            if GROUP_COMMIT_WINDOW > 0:
+                time.sleep(GROUP_COMMIT_WINDOW)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._leader = False
+            self._commit(batch)
+
+        return mutation.future.result()
+
+    def _commit(self, batch: List[_Mutation]) -> None:
+        metrics.GROUP_COMMIT_SIZE.observe(len(batch))
+        try:
+            with self.shard.lock():
+                creates = sum(mutation.kind == "create" for mutation in batch)
+                next_id = OrderService._allocate_ids(creates) if creates else None
+
+                orders = self.shard.load({})
+                results = []
+                changes = []
+                for mutation in batch:
+                    if mutation.kind == "create":
+                        mutation.order_id = str(next_id)
+                        next_id += 1
+                    old = orders.get(mutation.order_id)
+                    old = dict(old) if old is not None else None
+                    result = self._apply(orders, mutation)
+                    results.append(result)
+                    if result is not None:
+                        new = orders.get(mutation.order_id)
+                        changes.append((old, dict(new) if new is not None else None))
+
+                written = any(result is not None for result in results)
+                if written:
+                    if creates:
+                        OrderService._add_orgs([self.org])
+                    previous = self.shard.cache.generation()
+                    generation = self.shard.save(orders)
+                    OrderService._patch_org_views(self.org, previous, generation, changes)
+        except Exception as e:
+            for mutation in batch:
+                mutation.future.set_exception(e)
+            return
+
+        # Bump and notify listeners (e.g. the fact sync) before anyone's write
+        # returns, so a client acting on its new order finds it everywhere.
+        if written:
+            OrderService._changed(changes)
+        for mutation, result in zip(batch, results):
+            mutation.future.set_result(result)
+
+    def _apply(self, orders: Dict[str, dict], mutation: _Mutation) -> Optional[dict]:
+        if mutation.kind == "create":
+            order = vars(Order(id=mutation.order_id, **mutation.value))
+            orders[mutation.order_id] = order
+            return order
+
+        if mutation.order_id not in orders:
+            logging.error("Order ID %s not found", mutation.order_id)
+            return None
+        previous_status = orders[mutation.order_id]["status"]
+        if mutation.kind == "status":
+            orders[mutation.order_id]["status"] = mutation.value.value
+            return _stamp_closed(orders[mutation.order_id], previous_status)
+        if mutation.kind == "delete":
+            return orders.pop(mutation.order_id)
+        raise ValueError(f"Unknown mutation {mutation.kind}")
+
+
+class _StatusChange:
+    """A status change and its status hooks. Called again after failing (a
+    background job's retry), it only redoes the steps that failed: the write
+    if it didn't happen, and the hooks that raised."""
+
+    def __init__(self, order_id: str, status: OrderStatus):
+        self.order_id = order_id
+        self.status = status
+        self.order: Optional[dict] = None
+        self.hooks_done: List[Callable[[dict], None]] = []
+
+    def __call__(self) -> Optional[dict]:
+        if self.order is None:
+            self.order = OrderService._submit(self.order_id, "status", self.status)
+            if self.order is None:
+                return None
+
+        failed = None
+        for hook in OrderService.status_hooks:
+            if hook in self.hooks_done:
+                continue
+            try:
+                hook(self.order)
+            except Exception as e:
+                failed = failed or e
+                continue
+            self.hooks_done.append(hook)
+        if failed is not None:
+            raise failed
+        return self.order
+
+
+def _stamp_closed(order: dict, previous_status: str) -> dict:
+    if order["status"] in TERMINAL_STATUSES and previous_status not in TERMINAL_STATUSES:
+        order["closed_at"] = time.time()
+    return order
+
+
 # Order management
 class OrderService:
+    # Called after every write with the list of (old, new) orders it changed,
+    # where old is None for a create and new is None for a delete. Bulk writes
+    # pass None instead of a list.
+    listeners: List[Callable[[OrderChanges], None]] = []
+    # Called with the updated order after a status change made through
+    # update_order_status. Slow side effects (inventory, notifications) go
+    # here: they run in the background job when the caller didn't wait.
+    status_hooks: List[Callable[[dict], None]] = []
+    # Background jobs, keyed by order id so one order's updates stay in order.
+    jobs = WorkQueue()
+
+    _files: Dict[str, _JsonFile] = {}
+    _committers: Dict[str, _GroupCommit] = {}
+    _committers_lock = threading.Lock()
+    # Structures derived from each org's shard (see order_search and
+    # order_stats), patched by our own writes and rebuilt after anyone else's.
+    _order_ids: Dict[str, "_OrderIds"] = {}
+    _search_indexes: Dict[str, SearchIndex] = {}
+    _stats: Dict[str, OrderStats] = {}
+    # Order id -> org for every order in `_order_ids`; may hold ids since
+    # removed by another worker, so always check against the org's view.
+    _order_orgs: Dict[str, str] = {}
+    # Views other modules derive the same way (see order_table); each is a
+    # dict of org -> view with `generation` and `apply(old, new)`.
+    extra_org_views: List[Dict[str, Any]] = []
+    _org_views_lock = threading.Lock()
+    _archiving_pid: Optional[int] = None
+    # (store generation, directory version, facts) for get_facts().
+    _facts_cache: Optional[Tuple[int, int, List[Tuple]]] = None
+
+    # Storage
     @staticmethod
-    def load_orders() -> Dict[str, Order]:
+    def _file(name: str) -> _JsonFile:
+        path = os.path.abspath(os.path.join(ORDERS_DIR, name))
+        json_file = OrderService._files.get(path)
+        if json_file is None:
+            OrderService._ensure_store()
+            json_file = OrderService._files[path] = _JsonFile(path)
+        return json_file
+
+    @staticmethod
+    def _orgs_file() -> _JsonFile:
+        return OrderService._file(ORGS_NAME)
+
+    @staticmethod
+    def _next_id_file() -> _JsonFile:
+        return OrderService._file(NEXT_ID_NAME)
+
+    @staticmethod
+    def _shard(org: str) -> _JsonFile:
+        return OrderService._file(os.path.join(SHARDS_DIR, _shard_filename(org)))
+
+    @staticmethod
+    def _committer(org: str) -> _GroupCommit:
+        shard = OrderService._shard(org)
+        with OrderService._committers_lock:
+            committer = OrderService._committers.get(shard.path)
+            if committer is None:
+                committer = OrderService._committers[shard.path] = _GroupCommit(org, shard)
+        return committer
+
+    @staticmethod
+    def _ensure_store() -> None:
+        if os.path.isdir(ORDERS_DIR):
+            return
+
         try:
-            with open("orders.json", "r") as f:
-                return json.load(f)
+            with open(LEGACY_ORDERS_PATH, "r") as f:
+                orders = json.load(f)
         except FileNotFoundError:
-            logging.warning("orders.json not found, returning empty orders")
-            return {}
+            logging.warning("orders.json not found, starting with empty orders")
+            orders = {}
+
+        # Build the store next to its final location and rename it into place,
+        # so concurrent workers never see a half-migrated store. Each caller
+        # (thread or process) gets its own scratch directory.
+        parent = os.path.dirname(os.path.abspath(ORDERS_DIR))
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(ORDERS_DIR) + ".", dir=parent)
+        os.mkdir(os.path.join(tmp_dir, SHARDS_DIR))
+        shards: Dict[str, Dict[str, dict]] = {}
+        for order_id, order in orders.items():
+            shards.setdefault(order["org"], {})[order_id] = order
+        for org, shard in shards.items():
+            with open(os.path.join(tmp_dir, SHARDS_DIR, _shard_filename(org)), "w") as f:
+                json.dump(shard, f, indent=4)
+        _write_json(os.path.join(tmp_dir, ORGS_NAME), sorted(shards))
+        _write_json(os.path.join(tmp_dir, NEXT_ID_NAME), {"next_id": _max_order_id(orders) + 1})
+
+        try:
+            os.rename(tmp_dir, ORDERS_DIR)
+        except OSError:
+            # Another worker got there first.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _archive_state() -> _JsonFile:
+        return OrderService._file(ARCHIVE_STATE_NAME)
+
+    @staticmethod
+    def _store_counter() -> SharedCache:
+        # Bumped on any write to any shard; used only as a counter.
+        return OrderService._file("_store").cache
+
+    @staticmethod
+    def generation() -> int:
+        return OrderService._store_counter().generation()
+
+    @staticmethod
+    def _changed(changes: OrderChanges = None) -> None:
+        OrderService._store_counter().bump()
+        # The write is already durable, so a failing listener (e.g. Oso being
+        # unreachable) must not turn it into an error; the fact sync's
+        # periodic reconcile repairs anything that was missed.
+        for listener in OrderService.listeners:
+            try:
+                listener(changes)
+            except Exception:
+                logging.exception("Order listener %r failed", listener)
+
+    @staticmethod
+    def _add_orgs(orgs) -> None:
+        if set(orgs) <= set(OrderService._orgs_file().snapshot([])):
+            return
+        orgs_file = OrderService._orgs_file()
+        with orgs_file.lock():
+            known = orgs_file.load([])
+            if not set(orgs) <= set(known):
+                orgs_file.save(sorted(set(known) | set(orgs)))
+
+    @staticmethod
+    def _allocate_ids(count: int, at_least: int = 0) -> int:
+        """Reserve `count` order ids and return the first. Ids are never
+        handed out twice, not even once archived."""
+        next_id_file = OrderService._next_id_file()
+        with next_id_file.lock():
+            first = max(next_id_file.load({}).get("next_id", 1), at_least)
+            next_id_file.save({"next_id": first + count})
+        return first
+
+    @staticmethod
+    def _reserve_ids(order_ids) -> None:
+        # Bulk writes bring their own ids; make sure they aren't handed out.
+        OrderService._allocate_ids(0, _max_order_id(order_ids) + 1)
+
+    # Reads
+    @staticmethod
+    def orgs() -> List[str]:
+        return list(OrderService._orgs_file().snapshot([]))
+
+    @staticmethod
+    def load_orders() -> Dict[str, Order]:
+        orders = {}
+        for org in OrderService.orgs():
+            orders.update(OrderService.load_org_orders(org))
+        return dict(sorted(orders.items(), key=lambda item: _order_id_key(item[0])))
+
+    @staticmethod
+    def load_org_orders(org: str) -> Dict[str, dict]:
+        return OrderService._shard(org).load({})
+
+    @staticmethod
+    def org_snapshot(org: str) -> Mapping[str, Mapping]:
+        """A read-only version of `org`'s orders. Cheaper than
+        `load_org_orders` for readers, and never changes under them."""
+        return OrderService._shard(org).snapshot({})
 
     @staticmethod
     def get_order(order_id: int):
-        orders = OrderService.load_orders()
-        return orders[order_id]
+        org = OrderService._org_of(order_id)
+        if org is None:
+            raise KeyError(order_id)
+        return _thaw(OrderService.org_snapshot(org)[order_id])
+
+    @staticmethod
+    def _org_of(order_id: str) -> Optional[str]:
+        def has_order(org: str) -> bool:
+            return OrderService.read_org_view(
+                OrderService._order_ids,
+                functools.partial(_OrderIds, org),
+                org,
+                lambda view: order_id in view.ids,
+            )
+
+        org = OrderService._order_orgs.get(order_id)
+        if org is not None and has_order(org):
+            return org
+        # Created by another worker, or gone: check every org, which brings
+        # any stale id views up to date.
+        for org in OrderService.orgs():
+            if has_order(org):
+                return org
+        return None
 
+    # Writes
     @staticmethod
     def save_orders(orders: Dict[str, dict]) -> None:
-        with open("orders.json", "w") as f:
-            json.dump(orders, f, indent=4)
+        # Only shards whose contents changed are rewritten.
+        by_org: Dict[str, Dict[str, dict]] = {org: {} for org in OrderService.orgs()}
+        for order_id, order in orders.items():
+            by_org.setdefault(order["org"], {})[order_id] = order
+
+        OrderService._reserve_ids(orders)
+        OrderService._add_orgs(by_org)
+        changed = False
+        for org, org_orders in sorted(by_org.items()):
+            shard = OrderService._shard(org)
+            with shard.lock():
+                if shard.load({}) != org_orders:
+                    shard.save(org_orders)
+                    changed = True
+
+        if changed:
+            OrderService._changed()
+
+    @staticmethod
+    def save_org_orders(org: str, orders: Dict[str, dict]) -> None:
+        OrderService._reserve_ids(orders)
+        OrderService._add_orgs([org])
+        shard = OrderService._shard(org)
+        with shard.lock():
+            shard.save(orders)
+        OrderService._changed()
 
     @staticmethod
     def reset_orders():
         try:
             with open("orders_backup.json", "r") as f:
                 orders_dict = json.load(f)
-                OrderService.save_orders(orders_dict)
         except FileNotFoundError:
             return {}
 
+        by_org: Dict[str, Dict[str, dict]] = {org: {} for org in OrderService.orgs()}
+        for order_id, order in orders_dict.items():
+            by_org.setdefault(order["org"], {})[order_id] = order
+
+        # Hold every shard lock, then the org list and id locks (always in
+        # that order), so no org-scoped write interleaves with the reset.
+        orgs_file, next_id_file = OrderService._orgs_file(), OrderService._next_id_file()
+        with ExitStack() as stack:
+            for org in sorted(by_org):
+                stack.enter_context(OrderService._shard(org).lock())
+            stack.enter_context(orgs_file.lock())
+            stack.enter_context(next_id_file.lock())
+
+            for org, org_orders in sorted(by_org.items()):
+                OrderService._shard(org).save(org_orders)
+            orgs_file.save(sorted({order["org"] for order in orders_dict.values()}))
+            next_id_file.save({"next_id": _max_order_id(orders_dict) + 1})
+            shutil.rmtree(os.path.join(ORDERS_DIR, ARCHIVE_DIR), ignore_errors=True)
+        OrderService._changed()
+
+    # Single-order writes go through the shard's group commit.
     @staticmethod
-    def update_order_status(order_id: str, status: OrderStatus) -> None:
-        orders = OrderService.load_orders()
-        if order_id in orders:
-            orders[order_id]["status"] = status.value
-            OrderService.save_orders(orders)
-        else:
+    def create_order(org: str, sold_by: str, customer: str, items: list) -> dict:
+        fields = dict(
+            org=org,
+            sold_by=sold_by,
+            customer=customer,
+            items=items,
+            status=OrderStatus.PENDING.value,
+        )
+        return OrderService._committer(org).submit(_Mutation("create", value=fields))
+
+    @staticmethod
+    def _submit(order_id: str, kind: str, value=None):
+        org = OrderService._org_of(order_id)
+        if org is None:
             logging.error("Order ID %s not found", order_id)
+            return None
+        return OrderService._committer(org).submit(_Mutation(kind, order_id, value))
+
+    @staticmethod
+    def delete_order(order_id: str) -> Optional[dict]:
+        return OrderService._submit(order_id, "delete")
+
+    @staticmethod
+    def update_order_status(
+        order_id: str, status: OrderStatus, background: bool = False, owner: Optional[str] = None
+    ):
+        """Set the order's status and run the status hooks. With `background`,
+        queue that as a job and return the `Job` instead of the order; raises
+        `work_queue.QueueFull` when too many jobs are pending."""
+        change = _StatusChange(order_id, status)
+        if background:
+            return OrderService.jobs.submit(order_id, change, owner=owner)
+        return change()
+
+    # Archive
+    @staticmethod
+    def archive_orders(now: Optional[float] = None) -> int:
+        """Move orders closed more than ARCHIVE_AFTER_SECONDS ago to the
+        archive. Returns how many were moved."""
+        now = time.time() if now is None else now
+        cutoff = now - ARCHIVE_AFTER_SECONDS
+        archive_dir = os.path.join(ORDERS_DIR, ARCHIVE_DIR)
+        os.makedirs(archive_dir, exist_ok=True)
+
+        archived = 0
+        for org in OrderService.orgs():
+            shard = OrderService._shard(org)
+            with shard.lock():
+                orders = shard.load({})
+                # Orders closed before closing times were recorded start their
+                # clock now, rather than all being archived at once.
+                stamped = []
+                for order in orders.values():
+                    if order["status"] in TERMINAL_STATUSES and order.get("closed_at") is None:
+                        stamped.append((dict(order), order))
+                        order["closed_at"] = now
+                closed = {
+                    order_id: order
+                    for order_id, order in orders.items()
+                    if order["status"] in TERMINAL_STATUSES and order["closed_at"] <= cutoff
+                }
+                if not closed and not stamped:
+                    continue
+
+                previous = shard.cache.generation()
+                if closed:
+                    # Write the segment before dropping the orders from the
+                    # shard: a crash in between leaves them in both, never in
+                    # neither.
+                    segment = f"{_segment_prefix(org)}.{time.time_ns()}.jsonl.gz"
+                    path = os.path.join(archive_dir, segment)
+                    with gzip.open(path + ".tmp", "wt") as f:
+                        for order in closed.values():
+                            f.write(json.dumps(order) + "\n")
+                    if FSYNC:
+                        with open(path + ".tmp", "rb") as f:
+                            os.fsync(f.fileno())
+                    os.replace(path + ".tmp", path)
+                    if FSYNC:
+                        _fsync_dir(archive_dir)
+
+                    # Shared by every org, and other workers archive too.
+                    state_file = OrderService._archive_state()
+                    with state_file.lock():
+                        state = state_file.load({})
+                        ids = [int(order_id) for order_id in closed if order_id.isdigit()]
+                        state["max_id"] = max(ids + [state.get("max_id", 0)])
+                        # Stats keep counting archived orders.
+                        archived_stats = OrderStats(0)
+                        archived_stats.merge(state.get("stats", {}).get(org, {}))
+                        for order in closed.values():
+                            archived_stats.apply(None, order)
+                        state.setdefault("stats", {})[org] = archived_stats.to_dict()
+                        state_file.save(state)
 
+                remaining = {oid: order for oid, order in orders.items() if oid not in closed}
+                generation = shard.save(remaining)
+
+            changes = [(old, new) for old, new in stamped if new["id"] not in closed]
+            changes += [(order, None) for order in closed.values()]
+            OrderService._patch_org_views(org, previous, generation, changes)
+            OrderService._changed(changes)
+            if closed:
+                archived += len(closed)
+                logging.info("Archived %d %s orders", len(closed), org)
+        return archived
+
+    @staticmethod
+    def load_archived_orders(org: str) -> Iterator[dict]:
+        """`org`'s archived orders, oldest segment first, read as iterated."""
+        pattern = _segment_pattern(org)
+        archive_dir = os.path.join(ORDERS_DIR, ARCHIVE_DIR)
+        for path in sorted(glob.glob(os.path.join(archive_dir, "*.jsonl.gz"))):
+            if not pattern.fullmatch(os.path.basename(path)):
+                continue
+            with gzip.open(path, "rt") as f:
+                for line in f:
+                    yield json.loads(line)
+
+    @staticmethod
+    def start_archiving(interval: float = ARCHIVE_INTERVAL_SECONDS) -> None:
+        """Archive in the background every `interval` seconds, once per worker."""
+        if interval <= 0 or OrderService._archiving_pid == os.getpid():
+            return
+        OrderService._archiving_pid = os.getpid()
+
+        def run():
+            try:
+                OrderService.archive_orders()
+            except Exception:
+                logging.exception("Archiving orders failed")
+            timer = threading.Timer(interval, run)
+            timer.daemon = True
+            timer.start()
+
+        timer = threading.Timer(0, run)
+        timer.daemon = True
+        timer.start()
+
+    # Derived per-org views
+    @staticmethod
+    def _org_view(views: Dict[str, Any], build: Callable[[int, Dict[str, dict]], Any], org: str):
+        shard = OrderService._shard(org)
+        with OrderService._org_views_lock:
+            view = views.get(org)
+            # Rebuilt when another worker (or a bulk write) changed the shard.
+            if view is None or view.generation != shard.cache.generation():
+                generation = shard.cache.generation()
+                view = views[org] = build(generation, shard.snapshot({}))
+            return view
+
+    @staticmethod
+    def read_org_view(
+        views: Dict[str, Any],
+        build: Callable[[int, Dict[str, dict]], Any],
+        org: str,
+        read: Callable[[Any], Any],
+    ):
+        """`read(view)` on `org`'s current view in `views`, with no write
+        patching it meanwhile."""
+        view = OrderService._org_view(views, build, org)
+        with OrderService._org_views_lock:
+            return read(view)
+
+    @staticmethod
+    def _patch_org_views(org: str, previous: int, generation: int, changes) -> None:
+        with OrderService._org_views_lock:
+            for views in (
+                OrderService._order_ids,
+                OrderService._search_indexes,
+                OrderService._stats,
+                *OrderService.extra_org_views,
+            ):
+                view = views.get(org)
+                if view is None or view.generation != previous:
+                    continue
+                for old, new in changes:
+                    view.apply(old, new)
+                view.generation = generation
+
+    # Search
+    @staticmethod
+    def search(org: str, query: str, status: Optional[str] = None) -> List[str]:
+        """Ids of `org`'s orders whose customer and items contain every word
+        of `query`, optionally only those in `status`."""
+        terms = query_terms(query, status)
+        if not terms:
+            return []
+        index = OrderService._org_view(OrderService._search_indexes, SearchIndex.build, org)
+        with OrderService._org_views_lock:
+            ids = index.search(terms)
+        return sorted(ids, key=_order_id_key)
+
+    # Stats
+    @staticmethod
+    def stats(org: str) -> dict:
+        """Counts of `org`'s orders per status, in total and per salesperson,
+        archived orders included."""
+        stats = OrderService._org_view(OrderService._stats, OrderStats.build, org)
+        total = OrderStats(stats.generation)
+        with OrderService._org_views_lock:
+            total.merge(stats.to_dict())
+        archived = OrderService._archive_state().snapshot({}).get("stats", {})
+        total.merge(archived.get(org, {}))
+        return {"org": org, **total.to_dict()}
 
     # This is just a convenience feature for the demo; in a real app you would
     # use Oso's centralized or localized authorization data.
     @staticmethod
-    def get_facts() -> List[Tuple]:
-        org_facts = [
+    def get_facts(orders: Optional[Mapping[str, Mapping]] = None) -> List[Tuple]:
+        if orders is None:
+            generation = OrderService.generation()
+            cached = OrderService._facts_cache
+            if cached and cached[:2] == (generation, directory.version):
+                metrics.record_cache("facts", True)
+                return cached[2]
+            metrics.record_cache("facts", False)
+
+            orders: Dict[str, Mapping] = {}
+            for org in OrderService.orgs():
+                orders.update(OrderService.org_snapshot(org))
+            facts = OrderService.get_facts(orders)
+            OrderService._facts_cache = (generation, directory.version, facts)
+            return facts
+
+        return OrderService.user_facts() + OrderService.order_facts(orders)
+
+    @staticmethod
+    def user_facts() -> List[Tuple]:
+        return [
             (
                 "has_role",
                 Value("User", key),
                 data["role"],
                 Value("Organization", data["org"]),
             )
-            for key, data in USERS.items()
+            for key, data in directory.items()
         ]
 
-        orders = OrderService.load_orders()
-
-        order_facts = [
+    @staticmethod
+    def order_facts(orders: Mapping[str, Mapping]) -> List[Tuple]:
+        return [
             (relation, Value("Order", data["id"]), field, Value(type, data[field]))
             for _, data in orders.items()
             for relation, field, type in [
@@ -70,4 +856,87 @@ class OrderService:
             ]
         ]
 
-        return org_facts + order_facts
\ No newline at end of file
+    # Warm-up
+    @staticmethod
+    def warm(workers: int = LOAD_WORKERS) -> int:
+        """Parse every shard and build its search index, stats and facts, one
+        shard per task over `workers` processes. Returns the number of orders.
+
+        Parsing in the pool also publishes each shard's shared snapshot, so
+        this process (and every other worker) picks the orders up from there
+        instead of parsing them again."""
+        start = time.perf_counter()
+        orgs = OrderService.orgs()
+        store_generation = OrderService.generation()
+        order_facts: List[Tuple] = []
+        total = 0
+        with ExitStack() as stack:
+            if workers > 1 and len(orgs) > 1:
+                pool = stack.enter_context(ProcessPoolExecutor(min(workers, len(orgs))))
+                futures = [pool.submit(_warm_shard, org) for org in orgs]
+                results = (future.result() for future in as_completed(futures))
+            else:
+                results = map(_warm_shard, orgs)
+
+            for done, (org, count, index, stats, facts, seconds) in enumerate(results, 1):
+                # Views built from a generation that's since moved on are
+                # rebuilt on first use.
+                with OrderService._org_views_lock:
+                    OrderService._search_indexes[org] = index
+                    OrderService._stats[org] = stats
+                order_facts.extend(facts)
+                total += count
+                logging.info(
+                    "Loaded %s: %d orders in %.1f ms (%d/%d shards)",
+                    org, count, seconds * 1000, done, len(orgs)
+                )
+
+        if OrderService.generation() == store_generation:
+            facts = OrderService.user_facts() + order_facts
+            OrderService._facts_cache = (store_generation, directory.version, facts)
+        processes = max(min(workers, len(orgs)), 1)
+        logging.info(
+            "Loaded %d orders from %d shards in %.1f ms using %d processes",
+            total, len(orgs), (time.perf_counter() - start) * 1000, processes
+        )
+        return total
+
+
+class _OrderIds:
+    """The ids of one org's orders, as a derived per-org view. Also keeps
+    `OrderService._order_orgs` pointing each of them at the org."""
+
+    def __init__(self, org: str, generation: int, orders: Mapping[str, Mapping]):
+        self.org = org
+        self.generation = generation
+        self.ids = set(orders)
+        OrderService._order_orgs.update(dict.fromkeys(self.ids, org))
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        if new is not None:
+            self.ids.add(new["id"])
+            OrderService._order_orgs[new["id"]] = self.org
+        elif old is not None:
+            self.ids.discard(old["id"])
+            OrderService._order_orgs.pop(old["id"], None)
+
+
+def _warm_shard(org: str):
+    start = time.perf_counter()
+    shard = OrderService._shard(org)
+    generation = shard.cache.generation()
+    orders = shard.snapshot({})
+    return (
+        org,
+        len(orders),
+        SearchIndex.build(generation, orders),
+        OrderStats.build(generation, orders),
+        OrderService.order_facts(orders),
+        time.perf_counter() - start,
+    )
+
+
+# Populate the shared order caches and derived views before serving so the
+# first request doesn't pay for parsing every shard.
+on_warm_up(OrderService.warm)
+on_warm_up(OrderService.start_archiving)
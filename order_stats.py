@@ -0,0 +1,56 @@
+from typing import Dict, Optional
+
+# Order counts per status for one org shard, in total and per salesperson.
+#
+# `OrderService` patches these from the (old, new) pairs of its own writes, so
+# every create, delete or status change costs a couple of counter updates and
+# reading the stats never touches the orders.
+
+StatusCounts = Dict[str, int]
+
+
+class OrderStats:
+    def __init__(self, generation: int):
+        # The shard generation these counts reflect.
+        self.generation = generation
+        self.counts: StatusCounts = {}
+        self.by_sold_by: Dict[str, StatusCounts] = {}
+
+    @classmethod
+    def build(cls, generation: int, orders: Dict[str, dict]) -> "OrderStats":
+        stats = cls(generation)
+        for order in orders.values():
+            stats.apply(None, order)
+        return stats
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        if old is not None:
+            self._count(old, -1)
+        if new is not None:
+            self._count(new, 1)
+
+    def merge(self, counts: dict) -> None:
+        """Add counts in the shape `to_dict` returns, e.g. those kept for
+        archived orders."""
+        for status, n in counts.get("counts", {}).items():
+            self.counts[status] = self.counts.get(status, 0) + n
+        for sold_by, seller_counts in counts.get("by_sold_by", {}).items():
+            seller = self.by_sold_by.setdefault(sold_by, {})
+            for status, n in seller_counts.items():
+                seller[status] = seller.get(status, 0) + n
+
+    def _count(self, order: dict, delta: int) -> None:
+        status = order["status"]
+        self.counts[status] = self.counts.get(status, 0) + delta
+        seller = self.by_sold_by.setdefault(order["sold_by"], {})
+        seller[status] = seller.get(status, 0) + delta
+
+    def to_dict(self) -> dict:
+        return {
+            "counts": {status: n for status, n in self.counts.items() if n},
+            "by_sold_by": {
+                sold_by: {status: n for status, n in counts.items() if n}
+                for sold_by, counts in sorted(self.by_sold_by.items())
+                if any(counts.values())
+            },
+        }
@@ -0,0 +1,187 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from oso_cloud import Value, ValueOfType
+from oso_cloud.helpers import from_api_concrete_value, from_api_fact, to_api_fact, to_api_value
+
+# In-process stand-in for the Oso Cloud server.
+#
+# It speaks the subset of the `oso_cloud.Oso` client API this repo uses and
+# evaluates the rules in `policy.polar` directly in Python, so benchmarks and
+# tests can exercise `app_oso.py` without a running Oso server. It does not
+# parse Polar: if you change `policy.polar`, change `_order_permissions` and
+# `_organization_permissions` to match.
+
+ORDER_PERMISSIONS = ("view_order", "fulfill_order", "cancel_order", "delete_order")
+
+Fact = Tuple
+
+
+def _canonical(fact: Fact) -> Fact:
+    # What the server stores and hands back from `get`: every argument a Value
+    # with a string id, so "admin" is Value("String", "admin") and Order 5 is
+    # Value("Order", "5").
+    return from_api_fact(to_api_fact(fact))
+
+
+def _value(value) -> Value:
+    return from_api_concrete_value(to_api_value(value))
+
+
+def _matches(want, got) -> bool:
+    if want is None:
+        return True
+    if isinstance(want, ValueOfType):
+        return isinstance(got, Value) and got.type == want.type
+    return want == got
+
+
+class _FactIndex:
+    def __init__(self, facts: Iterable[Fact] = ()):
+        self.facts: Set[Fact] = set()
+        # (user, org) -> roles
+        self.roles: Dict[Tuple[Value, Value], Set[str]] = defaultdict(set)
+        # (resource, relation) -> related values
+        self.relations: Dict[Tuple[Value, str], Set[Value]] = defaultdict(set)
+        for fact in facts:
+            self.add(fact)
+
+    def add(self, fact: Fact) -> None:
+        fact = _canonical(fact)
+        if fact in self.facts:
+            return
+        self.facts.add(fact)
+        if fact[0] == "has_role":
+            _, user, role, org = fact
+            self.roles[(user, org)].add(role.id)
+        elif fact[0] == "has_relation":
+            _, resource, relation, value = fact
+            self.relations[(resource, relation.id)].add(value)
+
+    def remove(self, fact: Fact) -> None:
+        fact = _canonical(fact)
+        if fact not in self.facts:
+            return
+        self.facts.discard(fact)
+        if fact[0] == "has_role":
+            _, user, role, org = fact
+            self.roles[(user, org)].discard(role.id)
+        elif fact[0] == "has_relation":
+            _, resource, relation, value = fact
+            self.relations[(resource, relation.id)].discard(value)
+
+
+class _Transaction:
+    def __init__(self):
+        self.inserts: List[Fact] = []
+        self.deletes: List[Fact] = []
+
+    def insert(self, fact: Fact) -> None:
+        self.inserts.append(fact)
+
+    def delete(self, fact: Fact) -> None:
+        self.deletes.append(fact)
+
+
+class LocalOso:
+    def __init__(self, url: Optional[str] = None, api_key: Optional[str] = None):
+        self.url = url
+        self.policy_contents: Optional[str] = None
+        self._facts = _FactIndex()
+
+    # Policy
+    def policy(self, policy: str) -> None:
+        self.policy_contents = policy
+
+    # Facts
+    def insert(self, fact: Fact) -> None:
+        self._facts.add(fact)
+
+    def delete(self, fact: Fact) -> None:
+        self._facts.remove(fact)
+
+    @contextmanager
+    def batch(self):
+        tx = _Transaction()
+        yield tx
+        for fact in tx.deletes:
+            self._facts.remove(fact)
+        for fact in tx.inserts:
+            self._facts.add(fact)
+
+    def get(self, fact: Fact) -> List[Fact]:
+        # `None` in the pattern matches anything, a `ValueOfType` any value of
+        # that type.
+        pattern = [fact[0]] + [
+            want if want is None or isinstance(want, ValueOfType) else _value(want)
+            for want in fact[1:]
+        ]
+        return [
+            stored
+            for stored in self._facts.facts
+            if len(stored) == len(pattern)
+            and all(_matches(want, got) for want, got in zip(pattern, stored))
+        ]
+
+    # Authorization
+    def authorize(
+        self, actor: Value, action: str, resource: Value, context_facts: Optional[List[Fact]] = None
+    ) -> bool:
+        return action in self.actions(actor, resource, context_facts)
+
+    def actions(
+        self, actor: Value, resource: Value, context_facts: Optional[List[Fact]] = None
+    ) -> List[str]:
+        actor, resource = _value(actor), _value(resource)
+        indexes = [self._facts]
+        if context_facts:
+            indexes.append(_FactIndex(context_facts))
+
+        if resource.type == "Organization":
+            return sorted(_organization_permissions(indexes, actor, resource))
+        if resource.type == "Order":
+            return sorted(_order_permissions(indexes, actor, resource))
+        return []
+
+
+def _roles(indexes: List[_FactIndex], user: Value, org: Value) -> Set[str]:
+    roles: Set[str] = set()
+    for index in indexes:
+        roles |= index.roles.get((user, org), set())
+
+    # "member" if "warehouse"; "member" if "sales"; "member" if "admin";
+    if roles & {"warehouse", "sales", "admin"}:
+        roles.add("member")
+    return roles
+
+
+def _related(indexes: List[_FactIndex], resource: Value, relation: str) -> Set[Value]:
+    related: Set[Value] = set()
+    for index in indexes:
+        related |= index.relations.get((resource, relation), set())
+    return related
+
+
+def _organization_permissions(indexes: List[_FactIndex], user: Value, org: Value) -> Set[str]:
+    roles = _roles(indexes, user, org)
+    permissions = set()
+    if roles & {"sales", "admin"}:
+        permissions.add("create_order")
+    return permissions
+
+
+def _order_permissions(indexes: List[_FactIndex], user: Value, order: Value) -> Set[str]:
+    permissions = set()
+    for org in _related(indexes, order, "org"):
+        roles = _roles(indexes, user, org)
+        if "admin" in roles:
+            permissions.update(ORDER_PERMISSIONS)
+        if "member" in roles:
+            permissions.add("view_order")
+        if "warehouse" in roles:
+            permissions.add("fulfill_order")
+
+    if user in _related(indexes, order, "sold_by"):
+        permissions.add("cancel_order")
+    return permissions
@@ -0,0 +1,176 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+import order_table
+from order_policy import ORDER_PERMISSIONS, Permissions, order_permissions
+from order_service import OrderService
+from user_directory import directory
+
+# Materialized (user, order) -> permissions view
+#
+# Answers "which of view/fulfill/cancel/delete does this user hold on each
+# order" with a lookup. A user's view is built the first time it's asked for and
+# then kept up to date from `OrderService` writes and user directory changes,
+# instead of evaluating the policy per order on every listing.
+#
+# Views are kept per org, like the search index and stats: writes made by other
+# worker processes aren't delivered to us, so an org's views are dropped and
+# rebuilt lazily once its shard generation moves on, and other orgs' stay.
+
+# Most users whose views are kept at once.
+MAX_USERS = int(os.environ.get("PERMISSION_VIEW_MAX_USERS", "10000"))
+
+
+class _OrgViews:
+    """The views of one org's users, as a derived per-org view: patched by
+    `OrderService`'s own writes to the org's shard and dropped when another
+    worker (or a bulk write) changed it."""
+
+    def __init__(self, generation: int, orders: Mapping[str, Mapping]):
+        self.generation = generation
+        # username -> {order_id: permissions}
+        self.views: Dict[str, Dict[str, Permissions]] = {}
+
+    def apply(self, old: Optional[dict], new: Optional[dict]) -> None:
+        # Users only hold permissions on orders of their own org, so every
+        # kept user of the org may be affected.
+        for username, view in self.views.items():
+            if old is not None:
+                view.pop(old["id"], None)
+            if new is not None:
+                permissions = order_permissions(username, directory.get(username), new)
+                if permissions:
+                    view[new["id"]] = permissions
+
+
+class PermissionView:
+    def __init__(self, max_users: int = MAX_USERS):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # org -> _OrgViews; read and written under OrderService's view lock.
+        self._orgs: Dict[str, _OrgViews] = {}
+        # username -> org of every kept view, least recently used first
+        self._users: "OrderedDict[str, str]" = OrderedDict()
+        self._directory_version: Optional[int] = directory.version
+
+    def for_user(self, username: str) -> Dict[str, Permissions]:
+        user = directory.get(username)
+        if user is None:
+            return {}
+        org = user["org"]
+        views = OrderService._org_view(self._orgs, _OrgViews, org)
+        with OrderService._org_views_lock:
+            view = views.views.get(username)
+            generation = views.generation
+            # A copy: the view keeps changing under the lock as writes land.
+            permissions = dict(view) if view is not None else None
+
+        if permissions is None:
+            view = self._build(username, user)
+            permissions = dict(view)
+            with OrderService._org_views_lock:
+                # Only kept if no write landed while it was built.
+                if self._orgs.get(org) is views and views.generation == generation:
+                    views.views[username] = view
+        self._touch(username, org)
+        return permissions
+
+    def for_orders(self, username: str, order_ids: List[str]) -> Dict[str, Permissions]:
+        """Like `for_user`, for only `order_ids`: a lookup per order rather
+        than a copy of the whole view. Without a kept view, just these orders
+        are checked and no view is built."""
+        user = directory.get(username)
+        if user is None:
+            return {}
+        org = user["org"]
+        views = OrderService._org_view(self._orgs, _OrgViews, org)
+        with OrderService._org_views_lock:
+            view = views.views.get(username)
+            if view is not None:
+                permissions = {
+                    order_id: view[order_id] for order_id in order_ids if order_id in view
+                }
+
+        if view is None:
+            orders = OrderService.org_snapshot(org)
+            permissions = {}
+            for order_id in order_ids:
+                if order_id in orders:
+                    granted = order_permissions(username, user, orders[order_id])
+                    if granted:
+                        permissions[order_id] = granted
+        else:
+            self._touch(username, org)
+        return permissions
+
+    def _build(self, username: str, user: dict) -> Dict[str, Permissions]:
+        if order_table.ENABLED:
+            return dict(order_table.user_permissions(username, user))
+        # Users can only be granted anything on orders of their own org:
+        # sellers are always members of the org they sold for.
+        view: Dict[str, Permissions] = {}
+        for order_id, order in OrderService.org_snapshot(user["org"]).items():
+            permissions = order_permissions(username, user, order)
+            if permissions:
+                view[order_id] = permissions
+        return view
+
+    def _touch(self, username: str, org: str) -> None:
+        with self._lock:
+            self._users[username] = org
+            self._users.move_to_end(username)
+            evicted = []
+            while len(self._users) > self.max_users:
+                evicted.append(self._users.popitem(last=False))
+        for evicted_username, evicted_org in evicted:
+            self._evict(evicted_username, evicted_org)
+
+    def _evict(self, username: str, org: str) -> None:
+        with OrderService._org_views_lock:
+            views = self._orgs.get(org)
+            if views is not None:
+                views.views.pop(username, None)
+
+    # Listeners
+    def on_user_changed(self, username: str) -> None:
+        with self._lock:
+            org = self._users.pop(username, None)
+            current, self._directory_version = self._directory_version, directory.version
+        if current is not None and directory.version == current + 1:
+            if org is not None:
+                self._evict(username, org)
+        else:
+            # Some change wasn't delivered to us.
+            with OrderService._org_views_lock:
+                self._orgs.clear()
+
+
+view = PermissionView()
+OrderService.extra_org_views.append(view._orgs)
+directory.listeners.append(view.on_user_changed)
+
+
+def list_orders(username: str) -> List[Tuple[Mapping, Permissions]]:
+    """The orders `username` holds any permission on, with those permissions."""
+    permissions_by_order = view.for_user(username)
+    user = directory.get(username)
+    orders = OrderService.org_snapshot(user["org"]) if user else {}
+    return [
+        (orders[order_id], permissions)
+        for order_id, permissions in permissions_by_order.items()
+        if order_id in orders
+    ]
+
+
+def list_archived_orders(username: str) -> Iterator[Tuple[dict, Permissions]]:
+    """Like `list_orders`, for archived orders. These aren't materialized:
+    they're read and checked as they're iterated."""
+    user = directory.get(username)
+    if user is None:
+        return
+    for order in OrderService.load_archived_orders(user["org"]):
+        permissions = order_permissions(username, user, order)
+        if permissions:
+            yield order, permissions
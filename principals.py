@@ -0,0 +1,59 @@
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import metrics
+from permissions import RBAC
+from user_directory import directory
+
+# Request principals
+#
+# The acting user is looked up by username in the user directory, never taken
+# from the role and org a client claims in its headers. Each principal is built
+# once, with its role's RBAC permissions already expanded, and reused until the
+# directory entry for that user changes.
+
+
+@dataclass(frozen=True)
+class Principal:
+    username: Optional[str]
+    org: Optional[str]
+    role: Optional[str]
+    # In RBAC order, as the client lists them.
+    permissions: Tuple[str, ...] = ()
+
+
+_principals: Dict[str, Principal] = {}
+_lock = threading.Lock()
+
+
+def _build(username: Optional[str]) -> Principal:
+    user = directory.get(username) if username else None
+    if user is None:
+        # Unknown users get no role, org or permissions.
+        return Principal(username, None, None)
+    permissions = tuple(p.value for p in RBAC.get(user["role"], ()))
+    return Principal(username, user["org"], user["role"], permissions)
+
+
+def resolve(username: Optional[str]) -> Principal:
+    principal = _principals.get(username)
+    metrics.record_cache("principals", principal is not None)
+    if principal is None:
+        version = directory.version
+        principal = _build(username)
+        if principal.role is not None:
+            with _lock:
+                # A change made while it was built has already been announced,
+                # so the principal could be out of date: don't keep it.
+                if directory.version == version:
+                    _principals[username] = principal
+    return principal
+
+
+def _on_user_changed(username: str) -> None:
+    with _lock:
+        _principals.pop(username, None)
+
+
+directory.listeners.append(_on_user_changed)
@@ -0,0 +1,153 @@
+import fcntl
+import functools
+import glob
+import hashlib
+import mmap
+import os
+import pickle
+import stat
+import struct
+import tempfile
+from typing import Any, Optional, Tuple
+
+import metrics
+
+# Cross-worker order cache
+#
+# Every worker process maps the same small counter file. `OrderService` bumps
+# the generation on every write and publishes a pickled snapshot of the orders
+# for that generation next to it, so the other workers see the write on their
+# next read and pick up the snapshot instead of re-parsing `orders.json`.
+#
+# Checking freshness costs one 8-byte read from shared memory. Each worker maps
+# the snapshot file it last adopted rather than reading it, so the pickled bytes
+# live once in the page cache however many workers there are, and callers
+# always get their own dicts to mutate. Whatever a worker parses from them
+# (e.g. `order_service`'s frozen snapshots) is still its own copy.
+#
+# Snapshots also record the backing file's mtime and size, so a file replaced
+# behind our back (a presenter restoring `orders.json` from git) is noticed.
+#
+# Snapshots are unpickled, so they're kept in a directory only this user can
+# write to: `oso-orders-<uid>` under SHARED_CACHE_DIR (default /dev/shm).
+
+CACHE_DIR = os.environ.get("SHARED_CACHE_DIR") or (
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+
+
+@functools.lru_cache(maxsize=None)
+def private_dir(base: str = CACHE_DIR) -> str:
+    """The caller's own directory under `base`, created with mode 0700. Raises
+    PermissionError if it exists but anyone else could write to it."""
+    path = os.path.join(base, f"oso-orders-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(
+            f"Shared cache directory {path} must be a directory owned by uid "
+            f"{os.getuid()} with mode 0700"
+        )
+    return path
+
+_COUNTER = struct.Struct("<Q")
+# Snapshot header: the backing file's (mtime_ns, size) when it was taken.
+_HEADER = struct.Struct("<QQ")
+
+
+class SharedCache:
+    def __init__(self, name: str, directory: Optional[str] = None):
+        self.prefix = os.path.join(directory or private_dir(), name)
+        self._counter_file = open(self.prefix + ".gen", "a+b")
+        if os.fstat(self._counter_file.fileno()).st_size < _COUNTER.size:
+            self._counter_file.truncate(_COUNTER.size)
+        self._counter = mmap.mmap(self._counter_file.fileno(), _COUNTER.size)
+
+        self._local_generation: Optional[int] = None
+        self._local_snapshot: Optional[mmap.mmap] = None
+
+    @classmethod
+    def for_path(cls, path: str) -> "SharedCache":
+        # One cache per backing file, so unrelated datasets never mix.
+        digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+        return cls(f"oso-orders-{digest}")
+
+    def generation(self) -> int:
+        return _COUNTER.unpack_from(self._counter)[0]
+
+    def bump(self) -> int:
+        fcntl.flock(self._counter_file, fcntl.LOCK_EX)
+        try:
+            generation = self.generation() + 1
+            _COUNTER.pack_into(self._counter, 0, generation)
+        finally:
+            fcntl.flock(self._counter_file, fcntl.LOCK_UN)
+        return generation
+
+    def _snapshot_path(self, generation: int) -> str:
+        return f"{self.prefix}.{generation}.pickle"
+
+    def get(self, signature: Tuple[int, int]) -> Optional[Any]:
+        """Return a fresh copy of the current generation's value, or None if
+        no worker has published it yet or the backing file has changed."""
+        generation = self.generation()
+        if generation != self._local_generation:
+            try:
+                snapshot = _map(self._snapshot_path(generation))
+            except FileNotFoundError:
+                metrics.record_cache("shared_orders", False)
+                return None
+            self._local_generation, self._local_snapshot = generation, snapshot
+
+        if _HEADER.unpack_from(self._local_snapshot) != signature:
+            metrics.record_cache("shared_orders", False)
+            return None
+
+        metrics.record_cache("shared_orders", True)
+        return pickle.loads(memoryview(self._local_snapshot)[_HEADER.size :])
+
+    def put(self, value: Any, generation: int, signature: Tuple[int, int]) -> None:
+        snapshot = _HEADER.pack(*signature)
+        snapshot += pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        path = self._snapshot_path(generation)
+        # Write then rename, so readers never see a partial snapshot.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(snapshot)
+        os.replace(tmp_path, path)
+
+        # Older generations can't be served any more.
+        for old_path in glob.glob(f"{self.prefix}.*.pickle"):
+            if old_path != path and _generation_of(old_path) < generation:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+
+        if generation == self.generation():
+            try:
+                self._local_generation, self._local_snapshot = generation, _map(path)
+            except FileNotFoundError:
+                # A newer generation was published meanwhile.
+                pass
+
+
+def _map(path: str) -> mmap.mmap:
+    # The mapping stays valid after the file is removed.
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def file_signature(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _generation_of(path: str) -> int:
+    try:
+        return int(path.rsplit(".", 2)[-2])
+    except ValueError:
+        return -1
@@ -0,0 +1,36 @@
+import logging
+import os
+import time
+from typing import Callable, List
+
+# Worker warm-up
+#
+# Modules register the expensive one-off work they would otherwise do on the
+# first request (connecting clients, pushing the policy, loading data). Call
+# `warm_up()` once per worker before it accepts traffic: the apps do it in
+# `__main__` (skipping the reloader's watcher process), and under a prefork
+# server call it from the post-fork hook (gunicorn's `post_worker_init`), not at
+# import time in the master.
+
+_hooks: List[Callable[[], None]] = []
+
+
+def on_warm_up(f: Callable[[], None]) -> Callable[[], None]:
+    _hooks.append(f)
+    return f
+
+
+def warm_up() -> None:
+    for hook in _hooks:
+        start = time.perf_counter()
+        hook()
+        logging.info(
+            "Warm-up %s took %.1f ms", hook.__name__, (time.perf_counter() - start) * 1000
+        )
+
+
+def is_reloader_parent(use_reloader: bool = True) -> bool:
+    """Whether this is the process Werkzeug's reloader only uses to watch files
+    and restart the server. It never serves requests, so it shouldn't warm up
+    (or start the timers warm-up starts)."""
+    return use_reloader and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
@@ -0,0 +1,47 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The modules under test read their configuration at import time, so point
+# the order store and shared cache at a scratch directory before any of them
+# are imported.
+_WORKDIR = tempfile.mkdtemp(prefix="orders-tests-")
+os.environ.setdefault("ORDERS_DIR", os.path.join(_WORKDIR, "orders.d"))
+os.environ.setdefault("SHARED_CACHE_DIR", _WORKDIR)
+os.environ.setdefault("ORDERS_FSYNC", "0")
+os.environ.setdefault("ORDERS_ARCHIVE_INTERVAL_SECONDS", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    """An order store of the test's own, seeded from orders.json, for tests
+    that change orders they didn't create (e.g. archiving)."""
+    import order_service
+    from order_service import OrderService
+
+    monkeypatch.setattr(order_service, "ORDERS_DIR", str(tmp_path / "orders.d"))
+    monkeypatch.setattr(OrderService, "_facts_cache", None)
+    # Views derived from the shared store's shards don't apply to this one.
+    views = [
+        OrderService._order_orgs,
+        OrderService._order_ids,
+        OrderService._search_indexes,
+        OrderService._stats,
+        *OrderService.extra_org_views,
+    ]
+    saved = [dict(view) for view in views]
+    for view in views:
+        view.clear()
+    yield OrderService
+    for view, contents in zip(views, saved):
+        view.clear()
+        view.update(contents)
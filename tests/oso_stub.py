@@ -0,0 +1,96 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# A minimal Oso Cloud server: just the fact and policy endpoints, speaking the
+# same JSON as the real API, so tests can drive the real `oso_cloud` client.
+
+StoredFact = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _matches(pattern: dict, fact: StoredFact) -> bool:
+    predicate, args = fact
+    if pattern["predicate"] != predicate or len(pattern["args"]) != len(args):
+        return False
+    return all(
+        (want["type"] is None or want["type"] == type)
+        and (want["id"] is None or want["id"] == id)
+        for want, (type, id) in zip(pattern["args"], args)
+    )
+
+
+class OsoStub:
+    def __init__(self):
+        self.facts: Set[StoredFact] = set()
+        self.policy = None
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                return json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if url.path == "/api/facts":
+                    pattern = {"predicate": params["predicate"], "args": []}
+                    for i in range(5):
+                        pattern["args"].append(
+                            {"type": params.get(f"args.{i}.type"), "id": params.get(f"args.{i}.id")}
+                        )
+                    facts = [
+                        fact
+                        for fact in stub.facts
+                        if _matches({**pattern, "args": pattern["args"][: len(fact[1])]}, fact)
+                    ]
+                    return self._reply(
+                        [
+                            {"predicate": p, "args": [{"type": t, "id": i} for t, i in args]}
+                            for p, args in facts
+                        ]
+                    )
+                if url.path == "/api/policy":
+                    policy = None if stub.policy is None else {"filename": "", "src": stub.policy}
+                    return self._reply({"policy": policy})
+                if url.path == "/api/policy_metadata":
+                    return self._reply({"metadata": {"resources": {}}})
+                self.send_error(404)
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path == "/api/batch":
+                    for changeset in self._body():
+                        for fact in changeset.get("inserts", []):
+                            args = tuple((arg["type"], arg["id"]) for arg in fact["args"])
+                            stub.facts.add((fact["predicate"], args))
+                        for pattern in changeset.get("deletes", []):
+                            stub.facts -= {f for f in stub.facts if _matches(pattern, f)}
+                    return self._reply({"message": "ok"})
+                if path == "/api/policy":
+                    stub.policy = self._body()["src"]
+                    return self._reply({"message": "ok"})
+                self.send_error(404)
+
+        return Handler
@@ -0,0 +1,96 @@
+import admission
+from app_decorated import app
+from order_service import OrderService
+
+HEADERS = {"X-User-Username": "AcmeSales1", "Idempotency-Key": "create-once"}
+ORDER = {"customer": "W. Coyote", "items": ["anvil"]}
+
+
+def test_a_rejected_request_is_not_replayed(monkeypatch):
+    client = app.test_client()
+    monkeypatch.setattr(admission.controller, "admit", lambda *args: ("user", 1.5))
+    response = client.post("/orders", json=ORDER, headers=HEADERS)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+    monkeypatch.undo()
+    response = client.post("/orders", json=ORDER, headers=HEADERS)
+    assert "Idempotent-Replayed" not in response.headers
+    assert response.status_code == 201
+    OrderService.delete_order(response.json["id"])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_a_bucket_allows_its_burst_then_refills_at_its_rate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    bucket = admission.TokenBucket(rate=2, burst=3)
+
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == 0.5
+
+    clock.now += 0.5
+    assert bucket.take() == 0
+    # Idle time refills it up to the burst, not beyond.
+    clock.now += 60
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() > 0
+
+
+def test_an_orgs_users_share_its_bucket(monkeypatch):
+    monkeypatch.setattr(admission.time, "monotonic", FakeClock())
+    limits = {"default": admission.RouteLimit(user_rate=1, user_burst=10, org_rate=1, org_burst=3)}
+    controller = admission.AdmissionController(limits)
+
+    assert [controller.admit("list_orders", f"user{n}", "Acme") for n in range(3)] == [("", 0)] * 3
+    assert controller.admit("list_orders", "user3", "Acme") == ("org", 1)
+    assert controller.admit("list_orders", "user3", "Zombo") == ("", 0)
+    # Each route has buckets of its own.
+    assert controller.admit("create_order", "user3", "Acme") == ("", 0)
+
+
+def test_routes_can_override_the_default_limits(monkeypatch):
+    monkeypatch.setattr(admission.time, "monotonic", FakeClock())
+    monkeypatch.setenv(
+        "ADMISSION_LIMITS",
+        '{"default": {"user_burst": 3}, "list_orders": {"user_rate": 0.5, "user_burst": 1}}',
+    )
+    limits = admission._load_limits()
+    assert limits["list_orders"] == admission.RouteLimit(user_rate=0.5, user_burst=1)
+    controller = admission.AdmissionController(limits)
+
+    assert controller.admit("list_orders", "AcmeSales1", None) == ("", 0)
+    assert controller.admit("list_orders", "AcmeSales1", None) == ("user", 2)
+    assert [controller.admit("create_order", "AcmeSales1", None) for _ in range(4)] == [
+        ("", 0),
+        ("", 0),
+        ("", 0),
+        ("user", 1 / admission.RouteLimit.user_rate),
+    ]
+
+
+def test_requests_over_the_in_flight_cap_are_rejected(monkeypatch):
+    controller = admission.AdmissionController(max_in_flight=1)
+    monkeypatch.setattr(admission, "controller", controller)
+    client = app.test_client()
+    headers = {"X-User-Username": "AcmeSales1"}
+
+    assert controller.enter()
+    try:
+        response = client.get("/orders", headers=headers)
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+    finally:
+        controller.leave()
+
+    assert client.get("/orders", headers=headers).status_code == 200
+    # The request gave its slot back.
+    assert controller.enter()
+    controller.leave()
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+os.environ.setdefault("OSO_LOCAL", "1")
+
+from app_oso import app  # noqa: E402
+from order_service import OrderService  # noqa: E402
+from work_queue import WorkQueue  # noqa: E402
+
+HEADERS = {"X-User-Username": "AcmeAdmin"}
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_search_requires_a_known_user(client):
+    response = client.get("/orders/search?q=anvil", headers={"X-User-Username": "Nobody"})
+    assert response.status_code == 403
+
+
+def test_search_finds_the_callers_orders(client):
+    response = client.get("/orders/search?q=anvil", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json and all(order["org"] == "Acme" for order in response.json)
+
+
+def test_status_changes_only_queue_when_asked_to(monkeypatch, client):
+    order = OrderService.create_order("Acme", "AcmeSales1", "W. Coyote", ["rocket"])
+    monkeypatch.setattr(OrderService, "jobs", WorkQueue(max_depth=0))
+
+    response = client.post(f"/orders/{order['id']}/fulfill", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json["status"] == "fulfilled"
+
+    response = client.post(
+        f"/orders/{order['id']}/fulfill", headers={**HEADERS, "Prefer": "respond-async"}
+    )
+    assert response.status_code == 503
+    OrderService.delete_order(order["id"])
+
+
+def test_negative_user_pages_are_rejected(client):
+    assert client.get("/users?offset=-1").status_code == 400
+    assert client.get("/users?limit=-1").status_code == 400
@@ -0,0 +1,35 @@
+import importlib
+
+import pytest
+
+APPS = ["app_hardcoded", "app_abstracted", "app_decorated"]
+
+
+@pytest.fixture(params=APPS)
+def client(request):
+    return importlib.import_module(request.param).app.test_client()
+
+
+def test_unknown_users_cannot_list_orders(client):
+    response = client.get("/orders", headers={"X-User-Username": "Nobody"})
+    assert response.status_code == 403
+
+
+def test_orders_carry_the_users_permissions(client):
+    response = client.get("/orders", headers={"X-User-Username": "AcmeWarehouse"})
+    assert response.status_code == 200
+    assert {tuple(order["permissions"]) for order in response.json} == {
+        ("view_orders", "fulfill_order")
+    }
+
+
+@pytest.mark.parametrize("query", ["limit=-1", "offset=-1", "offset=-5&limit=2"])
+def test_negative_pages_are_rejected(client, query):
+    assert client.get(f"/users?{query}").status_code == 400
+
+
+def test_users_are_paginated(client):
+    response = client.get("/users?offset=1&limit=2")
+    assert response.status_code == 200
+    assert len(response.json) == 2
+    assert int(response.headers["X-Total-Count"]) > 2
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from data import OrderStatus
+from order_service import ARCHIVE_AFTER_SECONDS, ARCHIVE_STATE_NAME, OrderService, _JsonFile
+
+
+def test_legacy_closed_orders_are_archived_only_after_the_age_limit(store):
+    order = OrderService.create_order("Zombo", "ZomboSales1", "E. Fudd", ["hat"])
+    OrderService.update_order_status(order["id"], OrderStatus.FULFILLED)
+    # As stored before closing times were recorded.
+    orders = OrderService.load_org_orders("Zombo")
+    orders[order["id"]]["closed_at"] = None
+    OrderService.save_org_orders("Zombo", orders)
+    before = OrderService.stats("Zombo")
+
+    now = time.time()
+    OrderService.archive_orders(now)
+    stamped = OrderService.get_order(order["id"])
+    assert stamped["closed_at"] == now
+
+    assert OrderService.archive_orders(now + ARCHIVE_AFTER_SECONDS + 1) >= 1
+    assert order["id"] not in OrderService.org_snapshot("Zombo")
+    archived = [o["id"] for o in OrderService.load_archived_orders("Zombo")]
+    assert order["id"] in archived
+
+    # Archived orders still count.
+    assert OrderService.stats("Zombo") == before
+
+
+def test_workers_archiving_different_orgs_keep_each_others_stats(store, monkeypatch):
+    orgs = ["Acme", "Zombo"]
+    for org in orgs:
+        order = OrderService.create_order(org, f"{org}Sales1", "E. Fudd", ["hat"])
+        OrderService.update_order_status(order["id"], OrderStatus.FULFILLED)
+    before = {org: OrderService.stats(org) for org in orgs}
+
+    # Each "worker" archives one org, and both read the archive state before
+    # either writes it back unless the state is locked.
+    worker_orgs = threading.local()
+    monkeypatch.setattr(OrderService, "orgs", staticmethod(lambda: [worker_orgs.org]))
+    both_loaded = threading.Barrier(2, timeout=0.5)
+    load = _JsonFile.load
+
+    def load_and_wait(self, default):
+        value = load(self, default)
+        if self.path.endswith(ARCHIVE_STATE_NAME):
+            try:
+                both_loaded.wait()
+            except threading.BrokenBarrierError:
+                pass
+        return value
+
+    monkeypatch.setattr(_JsonFile, "load", load_and_wait)
+
+    def archive(org):
+        worker_orgs.org = org
+        OrderService.archive_orders(time.time() + ARCHIVE_AFTER_SECONDS + 1)
+
+    threads = [threading.Thread(target=archive, args=(org,)) for org in orgs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {org: OrderService.stats(org) for org in orgs} == before
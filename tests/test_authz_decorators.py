@@ -0,0 +1,70 @@
+import pytest
+from flask import Flask, request
+
+import order_context
+import principals
+from authz_decorators import (
+    require_permission,
+    require_same_org,
+    require_user_is_owner_if_sales,
+)
+
+ORDER = {"id": "1", "org": "Acme", "sold_by": "AcmeSales1", "status": "pending"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    loads = []
+
+    def find_order(order_id):
+        loads.append(order_id)
+        return ORDER if order_id == ORDER["id"] else None
+
+    monkeypatch.setattr(order_context, "find_order", find_order)
+
+    app = Flask(__name__)
+
+    @app.before_request
+    def attach_user():
+        request.user = principals.resolve(request.headers.get("X-User-Username"))
+
+    # Declared most expensive first; the guard still checks the role first.
+    @app.route("/orders/<order_id>/cancel", methods=["POST"])
+    @require_user_is_owner_if_sales()
+    @require_same_org()
+    @require_permission("cancel_order")
+    def cancel_order(order_id):
+        return "cancelled"
+
+    client = app.test_client()
+    client.loads = loads
+    client.view = app.view_functions["cancel_order"]
+    return client
+
+
+def cancel(client, username, order_id="1"):
+    return client.post(f"/orders/{order_id}/cancel", headers={"X-User-Username": username})
+
+
+def test_stacked_requirements_compile_into_one_guard(client):
+    assert client.view.__wrapped__.__name__ == "cancel_order"
+    assert [r.name for r in client.view.__authz_requirements__] == [
+        "owner_if_sales",
+        "same_org",
+        "cancel_order",
+    ]
+
+
+def test_the_order_is_loaded_once_and_only_when_needed(client):
+    assert cancel(client, "AcmeWarehouse").status_code == 403
+    assert client.loads == []
+
+    assert cancel(client, "AcmeSales1").status_code == 200
+    assert client.loads == ["1"]
+
+
+def test_each_requirement_is_enforced(client):
+    assert cancel(client, "AcmeSales2").status_code == 403
+    assert cancel(client, "ZomboAdmin").status_code == 403
+    assert cancel(client, "AcmeAdmin").status_code == 200
+    assert cancel(client, "AcmeAdmin", order_id="2").status_code == 404
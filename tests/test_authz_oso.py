@@ -0,0 +1,29 @@
+import pytest
+from oso_cloud import Oso
+
+from authz_oso import push_policy
+from tests.oso_stub import OsoStub
+
+
+@pytest.fixture
+def stub():
+    stub = OsoStub()
+    yield stub
+    stub.close()
+
+
+def test_policy_is_pushed_only_when_the_server_lacks_it(stub, tmp_path):
+    oso = Oso(url=stub.url, api_key="test")
+    policy = tmp_path / "policy.polar"
+    policy.write_text('actor User {}\n')
+
+    assert push_policy(oso, str(policy))
+    assert not push_policy(oso, str(policy))
+
+    # A server that restarted empty gets it again.
+    stub.policy = None
+    assert push_policy(oso, str(policy))
+
+    policy.write_text('actor User {}\nresource Order {}\n')
+    assert push_policy(oso, str(policy))
+    assert stub.policy == policy.read_text()
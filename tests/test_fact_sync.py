@@ -0,0 +1,95 @@
+import pytest
+from oso_cloud import Oso, Value
+
+from fact_sync import FactSync
+from oso_local import LocalOso
+from order_service import OrderService
+from tests.oso_stub import OsoStub
+
+
+@pytest.fixture
+def stub():
+    stub = OsoStub()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def oso(stub):
+    return Oso(url=stub.url, api_key="test")
+
+
+def test_reconcile_is_a_no_op_once_the_server_is_in_sync(oso):
+    sync = FactSync(oso)
+    inserted, deleted = sync.reconcile()
+    assert inserted == len(set(OrderService.get_facts()))
+    assert deleted == 0
+
+    # The server hands facts back in its own shape (roles as
+    # Value("String", ...)); they must still match what we derive.
+    assert sync.reconcile() == (0, 0)
+
+
+def test_reconcile_repairs_drift_without_touching_the_rest(stub, oso):
+    sync = FactSync(oso)
+    sync.reconcile()
+    stray = ("has_role", Value("User", "nobody"), "admin", Value("Organization", "Nowhere"))
+    oso.insert(stray)
+    missing = OrderService.get_facts()[0]
+    oso.delete(missing)
+
+    assert sync.reconcile() == (1, 1)
+    assert oso.get(stray) == []
+    assert len(oso.get(missing)) == 1
+
+
+def test_local_stand_in_returns_facts_like_the_server(oso):
+    local = LocalOso()
+    fact = ("has_relation", Value("Order", "999999"), "org", Value("Organization", "Acme"))
+    oso.insert(fact)
+    local.insert(fact)
+
+    pattern = ("has_relation", None, "org", None)
+    assert local.get(pattern) == oso.get(pattern)
+    assert FactSync(local).reconcile()[1] == 1
+
+
+def test_a_failing_sync_does_not_fail_the_write():
+    def unreachable(changes):
+        raise ConnectionError("Oso is down")
+
+    OrderService.listeners.append(unreachable)
+    try:
+        order = OrderService.create_order("Acme", "AcmeSales", "Wile E. Coyote", ["anvil"])
+    finally:
+        OrderService.listeners.remove(unreachable)
+    try:
+        assert OrderService.get_order(order["id"]) is not None
+    finally:
+        OrderService.delete_order(order["id"])
+
+
+def test_a_write_pushes_only_the_facts_of_the_orders_it_changed(oso):
+    sync = FactSync(oso)
+    sync.reconcile()
+    OrderService.listeners.append(sync.sync)
+    try:
+        order = OrderService.create_order("Acme", "AcmeSales", "Wile E. Coyote", ["anvil"])
+        fact = ("has_relation", Value("Order", order["id"]), "org", Value("Organization", "Acme"))
+        assert len(oso.get(fact)) == 1
+
+        # A status change doesn't change any facts.
+        assert sync.sync([(order, {**order, "status": "fulfilled"})]) == (0, 0)
+
+        OrderService.delete_order(order["id"])
+        assert oso.get(fact) == []
+    finally:
+        OrderService.listeners.remove(sync.sync)
+    assert sync.reconcile() == (0, 0)
+
+
+def test_reconcile_leaves_facts_it_does_not_own(oso):
+    other = ("has_relation", Value("Order", "1"), "parent", Value("Order", "2"))
+    oso.insert(other)
+    FactSync(oso).reconcile()
+    assert len(oso.get(other)) == 1
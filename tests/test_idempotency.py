@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+from flask import Flask, jsonify, request
+
+import idempotency
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(idempotency, "store", idempotency.IdempotencyStore())
+    app = Flask(__name__)
+    idempotency.init_app(app)
+    app.calls = []
+    app.release = threading.Event()
+    app.release.set()
+
+    @app.route("/orders", methods=["POST"])
+    def create():
+        app.calls.append(request.json)
+        app.release.wait(5)
+        return jsonify({"id": str(len(app.calls)), **request.json}), 201
+
+    return app
+
+
+def post(client, body, key="key-1", user="AcmeSales1"):
+    return client.post(
+        "/orders", json=body, headers={"Idempotency-Key": key, "X-User-Username": user}
+    )
+
+
+def test_a_retry_gets_the_first_response_back(app):
+    client = app.test_client()
+    first = post(client, {"customer": "R. Runner"})
+    retry = post(client, {"customer": "R. Runner"})
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert len(app.calls) == 1
+
+    # Keys are per user.
+    other_user = post(client, {"customer": "R. Runner"}, user="AcmeAdmin")
+    assert "Idempotent-Replayed" not in other_user.headers
+
+
+def test_a_concurrent_retry_waits_for_the_first_request(app):
+    app.release.clear()
+    responses = {}
+
+    def send(name):
+        responses[name] = post(app.test_client(), {"customer": "R. Runner"})
+
+    first = threading.Thread(target=send, args=("first",))
+    first.start()
+    for _ in range(500):
+        if app.calls:
+            break
+        threading.Event().wait(0.01)
+    retry = threading.Thread(target=send, args=("retry",))
+    retry.start()
+    retry.join(0.2)
+    assert retry.is_alive()
+
+    app.release.set()
+    first.join()
+    retry.join()
+    assert len(app.calls) == 1
+    assert responses["retry"].get_json() == responses["first"].get_json()
+    assert responses["retry"].headers["Idempotent-Replayed"] == "true"
+
+
+def test_reusing_a_key_for_a_different_body_is_rejected(app):
+    client = app.test_client()
+    post(client, {"customer": "R. Runner"})
+    response = post(client, {"customer": "W. Coyote"})
+    assert response.status_code == 422
+    assert len(app.calls) == 1
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"query_string": "dry_run=1"},
+        {"headers": {"Accept": "application/vnd.orders.columnar+json"}},
+        {"headers": {"Prefer": "respond-async"}},
+    ],
+)
+def test_reusing_a_key_with_different_parameters_is_rejected(app, change):
+    client = app.test_client()
+    post(client, {"customer": "R. Runner"})
+
+    headers = {"Idempotency-Key": "key-1", "X-User-Username": "AcmeSales1"}
+    headers.update(change.get("headers", {}))
+    response = client.post(
+        "/orders",
+        json={"customer": "R. Runner"},
+        headers=headers,
+        query_string=change.get("query_string"),
+    )
+    assert response.status_code == 422
+    assert len(app.calls) == 1
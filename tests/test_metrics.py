@@ -0,0 +1,33 @@
+import threading
+
+import metrics
+
+LABEL_SETS = 50
+
+
+def test_render_while_new_label_sets_are_added():
+    counter = metrics.Counter("test_render_counter", "Test counter.", ("n",))
+    histogram = metrics.Histogram("test_render_histogram", "Test histogram.", ("n",))
+    stop = threading.Event()
+
+    def add_labels():
+        # Cycle through a fixed number of label sets so memory stays bounded.
+        n = 0
+        while not stop.is_set():
+            counter.inc(str(n % LABEL_SETS))
+            histogram.observe(0.001, str(n % LABEL_SETS))
+            n += 1
+
+    writer = threading.Thread(target=add_labels)
+    writer.start()
+    try:
+        for _ in range(200):
+            counter.render()
+            histogram.render()
+    finally:
+        stop.set()
+        writer.join()
+        metrics._registry.remove(counter)
+        metrics._registry.remove(histogram)
+
+    assert len(counter.render()) <= 2 + LABEL_SETS
@@ -0,0 +1,61 @@
+import pytest
+
+import admission
+from app_decorated import app
+from order_service import OrderService
+
+HEADERS = {"X-User-Username": "AcmeWarehouse", "Idempotency-Key": "fulfill-once"}
+
+
+@pytest.fixture
+def order_id():
+    order = OrderService.create_order("Acme", "AcmeSales1", "R. Runner", ["rocket skates"])
+    yield order["id"]
+    OrderService.delete_order(order["id"])
+
+
+def test_a_failed_write_is_reported_and_not_replayed(monkeypatch, order_id):
+    def unavailable(order_id, status, **kwargs):
+        raise OSError("disk full")
+
+    client = app.test_client()
+    free_slots = admission.controller._in_flight._value
+
+    monkeypatch.setattr(OrderService, "update_order_status", staticmethod(unavailable))
+    response = client.post(f"/orders/{order_id}/fulfill", headers=HEADERS)
+    assert response.status_code == 500
+    assert OrderService.get_order(order_id)["status"] == "pending"
+    assert admission.controller._in_flight._value == free_slots
+
+    monkeypatch.undo()
+    response = client.post(f"/orders/{order_id}/fulfill", headers=HEADERS)
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+    assert OrderService.get_order(order_id)["status"] == "fulfilled"
+
+
+def test_status_changes_run_the_status_hooks(order_id):
+    changed = []
+    OrderService.status_hooks.append(changed.append)
+    try:
+        response = app.test_client().post(
+            f"/orders/{order_id}/fulfill", headers={"X-User-Username": "AcmeWarehouse"}
+        )
+    finally:
+        OrderService.status_hooks.remove(changed.append)
+    assert response.status_code == 200
+    assert [order["id"] for order in changed] == [order_id]
+
+
+def test_a_status_change_to_an_order_deleted_meanwhile_is_404(monkeypatch, order_id):
+    update_order_status = OrderService.update_order_status
+
+    def deleted_first(order_id, status, **kwargs):
+        OrderService.delete_order(order_id)
+        return update_order_status(order_id, status, **kwargs)
+
+    monkeypatch.setattr(OrderService, "update_order_status", staticmethod(deleted_first))
+    response = app.test_client().post(
+        f"/orders/{order_id}/fulfill", headers={"X-User-Username": "AcmeWarehouse"}
+    )
+    assert response.status_code == 404
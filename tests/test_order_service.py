@@ -0,0 +1,261 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import order_service
+from data import OrderStatus
+from order_service import OrderService
+
+
+def test_concurrent_first_use_builds_the_store_once(monkeypatch, tmp_path):
+    legacy = tmp_path / "orders.json"
+    # Enough shards that the builds overlap.
+    orders = {str(n): {"id": str(n), "org": f"Org{n % 200}", "status": "pending"}
+              for n in range(1, 1001)}
+    legacy.write_text(json.dumps(orders))
+    orders_dir = tmp_path / "orders.d"
+    monkeypatch.setattr(order_service, "LEGACY_ORDERS_PATH", str(legacy))
+    monkeypatch.setattr(order_service, "ORDERS_DIR", str(orders_dir))
+
+    errors = []
+    start = threading.Barrier(8)
+
+    def first_use():
+        start.wait()
+        try:
+            order_service.OrderService._ensure_store()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=first_use) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(os.listdir(tmp_path)) == ["orders.d", "orders.json"]
+    orgs = json.loads((orders_dir / order_service.ORGS_NAME).read_text())
+    assert orgs == sorted({order["org"] for order in orders.values()})
+    next_id = json.loads((orders_dir / order_service.NEXT_ID_NAME).read_text())
+    assert next_id == {"next_id": 1001}
+
+
+def test_a_write_only_rewrites_its_own_org():
+    order = OrderService.create_order("Acme", "AcmeSales1", "R. Runner", ["bird seed"])
+    try:
+        shared = [
+            os.path.join(order_service.ORDERS_DIR, order_service.ORGS_NAME),
+            OrderService._shard("Zombo").path,
+        ]
+        before = [os.stat(path).st_mtime_ns for path in shared]
+        OrderService.update_order_status(order["id"], OrderStatus.FULFILLED)
+        assert [os.stat(path).st_mtime_ns for path in shared] == before
+    finally:
+        OrderService.delete_order(order["id"])
+
+
+@pytest.mark.parametrize("org", ["Acme_Inc", "_orgs", "_next_id", "_store", "../Acme"])
+def test_every_org_gets_its_own_shard(store, org):
+    acme = store.create_order("Acme Inc", "AcmeSales1", "R. Runner", ["bird seed"])
+    other = store.create_order(org, "AcmeSales1", "W. Coyote", ["anvil"])
+
+    assert set(store.load_org_orders("Acme Inc")) == {acme["id"]}
+    assert set(store.load_org_orders(org)) == {other["id"]}
+    store.save_orders(store.load_orders())
+    assert store.get_order(acme["id"]) == acme
+    assert {"Acme Inc", org} <= set(store.orgs())
+    assert int(store.create_order("Acme", "AcmeSales1", "B. Bunny", ["carrots"])["id"]) > int(
+        other["id"]
+    )
+
+
+def test_orders_written_by_another_worker_are_found():
+    order = OrderService.create_order("Zombo", "ZomboSales1", "E. Fudd", ["hat"])
+    try:
+        # What this worker knows about the ids, as if another worker wrote it.
+        OrderService._order_orgs.clear()
+        OrderService._order_ids.clear()
+        assert OrderService.get_order(order["id"])["customer"] == "E. Fudd"
+    finally:
+        OrderService.delete_order(order["id"])
+    with pytest.raises(KeyError):
+        OrderService.get_order(order["id"])
+
+
+def test_concurrent_writes_to_a_shard_are_committed_together(monkeypatch):
+    monkeypatch.setattr(order_service, "GROUP_COMMIT_WINDOW", 0.05)
+    saves = []
+    save = order_service._JsonFile.save
+
+    def counting_save(self, value):
+        if self.path == OrderService._shard("Acme").path:
+            saves.append(len(value))
+        return save(self, value)
+
+    monkeypatch.setattr(order_service._JsonFile, "save", counting_save)
+
+    created = []
+    start = threading.Barrier(10)
+
+    def create(n):
+        start.wait()
+        created.append(OrderService.create_order("Acme", "AcmeSales1", f"Customer {n}", ["anvil"]))
+
+    threads = [threading.Thread(target=create, args=(n,)) for n in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert len(created) == 10
+        assert len(saves) < 10
+        snapshot = OrderService.org_snapshot("Acme")
+        assert all(snapshot[order["id"]]["customer"] == order["customer"] for order in created)
+    finally:
+        for order in created:
+            OrderService.delete_order(order["id"])
+
+
+def test_listeners_see_every_commit_before_its_writers_return(monkeypatch):
+    monkeypatch.setattr(order_service, "GROUP_COMMIT_WINDOW", 0.05)
+    notified = set()
+
+    def slow_listener(changes):
+        time.sleep(0.05)
+        notified.update(new["id"] for _, new in changes or [] if new is not None)
+
+    monkeypatch.setattr(OrderService, "listeners", [*OrderService.listeners, slow_listener])
+
+    unseen = []
+    created = []
+    start = threading.Barrier(5)
+
+    def create(n):
+        start.wait()
+        order = OrderService.create_order("Acme", "AcmeSales1", f"Customer {n}", ["anvil"])
+        created.append(order)
+        if order["id"] not in notified:
+            unseen.append(order["id"])
+
+    threads = [threading.Thread(target=create, args=(n,)) for n in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for order in created:
+        OrderService.delete_order(order["id"])
+
+    assert len(created) == 5
+    assert unseen == []
+
+
+def test_order_ids_are_unique_across_orgs():
+    created = []
+    start = threading.Barrier(8)
+
+    def create(org):
+        start.wait()
+        for _ in range(5):
+            created.append(OrderService.create_order(org, f"{org}Sales1", "W. Coyote", ["rope"]))
+
+    threads = [threading.Thread(target=create, args=(org,)) for org in ["Acme", "Zombo"] * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        ids = [order["id"] for order in created]
+        assert len(ids) == 40
+        assert len(set(ids)) == 40
+    finally:
+        for order in created:
+            OrderService.delete_order(order["id"])
+
+
+def test_a_snapshot_never_changes_under_its_reader():
+    order = OrderService.create_order("Acme", "AcmeSales1", "R. Runner", ["bird seed"])
+    try:
+        snapshot = OrderService.org_snapshot("Acme")
+        with pytest.raises(TypeError):
+            snapshot[order["id"]]["status"] = "fulfilled"
+        with pytest.raises(AttributeError):
+            snapshot[order["id"]]["items"].append("anvil")
+
+        stop = threading.Event()
+        writes = []
+
+        def write():
+            statuses = [OrderStatus.FULFILLED, OrderStatus.PENDING]
+            while not stop.is_set():
+                OrderService.update_order_status(order["id"], statuses[len(writes) % 2])
+                writes.append(1)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            while len(writes) < 5:
+                assert snapshot[order["id"]]["status"] == "pending"
+                assert OrderService.org_snapshot("Acme")[order["id"]]["status"] in (
+                    "pending",
+                    "fulfilled",
+                )
+        finally:
+            stop.set()
+            writer.join()
+
+        assert OrderService.org_snapshot("Acme") is not snapshot
+        assert snapshot[order["id"]]["status"] == "pending"
+    finally:
+        OrderService.delete_order(order["id"])
+
+
+def test_warm_up_parses_shards_in_worker_processes(store, monkeypatch):
+    pools = []
+
+    class RecordingPool(order_service.ProcessPoolExecutor):
+        def __init__(self, max_workers):
+            pools.append(max_workers)
+            super().__init__(max_workers)
+
+    monkeypatch.setattr(order_service, "ProcessPoolExecutor", RecordingPool)
+    orgs = store.orgs()
+    assert len(orgs) > 1
+
+    total = store.warm(workers=2)
+
+    assert pools == [2]
+    assert total == sum(len(store.org_snapshot(org)) for org in orgs)
+    for org in orgs:
+        generation = store._shard(org).cache.generation()
+        assert store._search_indexes[org].generation == generation
+        assert store._stats[org].generation == generation
+        assert store._stats[org].to_dict() == order_service.OrderStats.build(
+            generation, store.org_snapshot(org)
+        ).to_dict()
+    assert store._facts_cache[0] == store.generation()
+    # Shards finish in any order.
+    assert sorted(map(repr, store._facts_cache[2])) == sorted(
+        map(repr, store.get_facts(store.load_orders()))
+    )
+
+
+def test_warm_up_skips_the_facts_of_a_store_written_meanwhile(store, monkeypatch):
+    warm_shard = order_service._warm_shard
+    created = []
+
+    def warm_shard_during_a_write(org):
+        if not created:
+            created.append(store.create_order("Acme", "AcmeSales1", "R. Runner", ["bird seed"]))
+        return warm_shard(org)
+
+    monkeypatch.setattr(order_service, "_warm_shard", warm_shard_during_a_write)
+    store.warm(workers=1)
+
+    assert store._facts_cache is None
+    facts = store.get_facts()
+    order = created[0]
+    assert all(fact in facts for fact in store.order_facts({order["id"]: order}))
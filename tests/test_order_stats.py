@@ -0,0 +1,29 @@
+from data import OrderStatus
+from order_service import OrderService
+from order_stats import OrderStats
+
+
+def rebuilt(org):
+    stats = OrderStats.build(0, OrderService.org_snapshot(org))
+    archived = OrderService._archive_state().snapshot({}).get("stats", {})
+    stats.merge(archived.get(org, {}))
+    return {"org": org, **stats.to_dict()}
+
+
+def test_counters_match_a_rebuild_after_writes():
+    before = OrderService.stats("Acme")
+    assert before == rebuilt("Acme")
+
+    first = OrderService.create_order("Acme", "AcmeSales1", "R. Runner", ["bird seed"])
+    second = OrderService.create_order("Acme", "AcmeSales2", "W. Coyote", ["anvil"])
+    try:
+        OrderService.update_order_status(first["id"], OrderStatus.FULFILLED)
+        OrderService.update_order_status(second["id"], OrderStatus.CANCELLED)
+        stats = OrderService.stats("Acme")
+        assert stats == rebuilt("Acme")
+        assert stats["counts"]["fulfilled"] == before["counts"].get("fulfilled", 0) + 1
+        assert stats["by_sold_by"]["AcmeSales2"]["cancelled"] >= 1
+    finally:
+        OrderService.delete_order(first["id"])
+        OrderService.delete_order(second["id"])
+    assert OrderService.stats("Acme") == before
@@ -0,0 +1,88 @@
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import order_table  # noqa: E402
+from order_policy import order_permissions  # noqa: E402
+from order_service import OrderService  # noqa: E402
+from order_table import OrderTable  # noqa: E402
+from user_directory import directory  # noqa: E402
+
+
+def _orders(n, org="Acme"):
+    statuses = ("pending", "fulfilled", "cancelled")
+    return {
+        str(i): {
+            "id": str(i),
+            "org": org,
+            "sold_by": f"seller{i % 3}",
+            "status": statuses[i // 2 % 3],
+        }
+        for i in range(1, n + 1)
+    }
+
+
+@pytest.mark.parametrize("role", ["admin", "warehouse", "sales", None])
+def test_permissions_match_the_policy(role):
+    orders = _orders(50)
+    table = OrderTable.build(0, orders)
+    user = {"org": "Acme", "role": role}
+
+    for username in ("seller1", "nobody"):
+        expected = {
+            order_id: order_permissions(username, user, order)
+            for order_id, order in orders.items()
+        }
+        assert table.permissions(username, role) == {
+            order_id: permissions for order_id, permissions in expected.items() if permissions
+        }
+
+
+def test_filters_and_counts_follow_writes():
+    orders = _orders(2000)
+    table = OrderTable.build(0, orders)
+
+    # Enough deletes to compact the table, then more orders than it has room for.
+    for order_id in list(orders)[:1500]:
+        table.apply(orders.pop(order_id), None)
+    for i in range(3000, 5000):
+        order = {"id": str(i), "org": "Acme", "sold_by": "seller9", "status": "pending"}
+        table.apply(None, order)
+        orders[order["id"]] = order
+    old = orders["3000"]
+    orders["3000"] = {**old, "status": "fulfilled"}
+    table.apply(old, orders["3000"])
+
+    assert sorted(table.order_ids()) == sorted(orders)
+    assert sorted(table.order_ids(status="fulfilled")) == sorted(
+        order_id for order_id, order in orders.items() if order["status"] == "fulfilled"
+    )
+    assert table.order_ids(status="pending", sold_by="seller9") == [
+        order_id for order_id, order in orders.items()
+        if order["status"] == "pending" and order["sold_by"] == "seller9"
+    ]
+    assert table.order_ids(status="shipped") == []
+    assert table.counts("status") == Counter(order["status"] for order in orders.values())
+    assert table.counts("sold_by", status="pending") == Counter(
+        order["sold_by"] for order in orders.values() if order["status"] == "pending"
+    )
+
+
+def test_org_tables_read_the_store():
+    order = OrderService.create_order("Acme", "AcmeSales1", "R. Runner", ["bird seed"])
+    try:
+        acme = OrderService.org_snapshot("Acme")
+        assert order["id"] in order_table.org_order_ids("Acme", sold_by="AcmeSales1")
+        assert order_table.org_counts("Acme", "status") == Counter(
+            o["status"] for o in acme.values()
+        )
+        user = directory.get("AcmeSales1")
+        assert order_table.user_permissions("AcmeSales1", user)[order["id"]] == (
+            "view_order",
+            "cancel_order",
+        )
+    finally:
+        OrderService.delete_order(order["id"])
+    assert order["id"] not in order_table.org_order_ids("Acme")
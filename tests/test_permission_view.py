@@ -0,0 +1,41 @@
+import permission_view
+from order_service import OrderService
+from permission_view import view
+
+
+def test_writes_patch_the_views_of_their_own_org_only():
+    acme = view.for_user("AcmeAdmin")
+    acme_views = view._orgs["Acme"]
+
+    order = OrderService.create_order("Zombo", "ZomboSales1", "E. Fudd", ["hat"])
+    try:
+        # Another worker's write to Zombo.
+        OrderService._shard("Zombo").cache.bump()
+        assert view.for_user("AcmeAdmin") == acme
+        assert view._orgs["Acme"] is acme_views
+        assert "AcmeAdmin" in acme_views.views
+    finally:
+        OrderService.delete_order(order["id"])
+
+    order = OrderService.create_order("Acme", "AcmeSales1", "R. Runner", ["bird seed"])
+    try:
+        assert view._orgs["Acme"] is acme_views
+        assert view.for_user("AcmeAdmin")[order["id"]] == permission_view.ORDER_PERMISSIONS
+    finally:
+        OrderService.delete_order(order["id"])
+    assert order["id"] not in view.for_user("AcmeAdmin")
+
+
+def test_permissions_for_some_orders_match_the_users_view():
+    order_ids = list(OrderService.org_snapshot("Acme"))[:3] + ["no-such-order"]
+    view._evict("AcmeSales1", "Acme")
+
+    # Without a kept view the orders are checked directly, and none is built.
+    unkept = view.for_orders("AcmeSales1", order_ids)
+    assert "AcmeSales1" not in view._orgs["Acme"].views
+
+    full = view.for_user("AcmeSales1")
+    expected = {order_id: full[order_id] for order_id in order_ids if order_id in full}
+    assert unkept == expected
+    assert view.for_orders("AcmeSales1", order_ids) == expected
+    assert view.for_orders("Nobody", order_ids) == {}
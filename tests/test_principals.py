@@ -0,0 +1,22 @@
+import principals
+from user_directory import directory
+
+
+def test_a_principal_built_during_a_directory_change_is_not_kept(monkeypatch):
+    directory.put("RaceUser", "Acme", "sales")
+    build = principals._build
+
+    def build_then_promote(username):
+        principal = build(username)
+        directory.put(username, "Acme", "admin")
+        return principal
+
+    monkeypatch.setattr(principals, "_build", build_then_promote)
+    try:
+        assert principals.resolve("RaceUser").role == "sales"
+        monkeypatch.setattr(principals, "_build", build)
+        assert principals.resolve("RaceUser").role == "admin"
+        assert principals.resolve("RaceUser") is principals.resolve("RaceUser")
+    finally:
+        directory.remove("RaceUser")
+    assert principals.resolve("RaceUser").role is None
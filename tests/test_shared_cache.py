@@ -0,0 +1,25 @@
+import os
+import stat
+
+import pytest
+
+import shared_cache
+from shared_cache import SharedCache
+
+
+def test_snapshots_live_in_a_private_directory(tmp_path):
+    directory = shared_cache.private_dir(str(tmp_path))
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+    cache = SharedCache("test", directory)
+    cache.put({"1": {"id": "1"}}, cache.bump(), (1, 2))
+    assert cache.get((1, 2)) == {"1": {"id": "1"}}
+    assert cache.get((1, 3)) is None
+
+
+def test_a_directory_others_can_write_to_is_refused(tmp_path):
+    directory = tmp_path / f"oso-orders-{os.getuid()}"
+    directory.mkdir()
+    directory.chmod(0o777)
+    with pytest.raises(PermissionError):
+        shared_cache.private_dir(str(tmp_path))
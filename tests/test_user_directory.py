@@ -0,0 +1,40 @@
+import datagen
+from user_directory import UserDirectory
+
+
+def test_pages_and_org_index_stay_in_step_with_updates():
+    directory = UserDirectory(datagen.generate_users(orgs=3, users=30, seed=1))
+    users, total = directory.page(offset=5, limit=10)
+    assert total == 30
+    assert [name for name, _ in users] == sorted(name for name, _ in directory.items())[5:15]
+
+    directory.put("Org0User99", "Org1", "admin")
+    directory.remove("Org2User1")
+    assert "Org0User99" in directory.usernames_in_org("Org1")
+    assert "Org2User1" not in directory.usernames_in_org("Org2")
+    assert directory.page()[1] == 30
+    for org in directory.orgs():
+        assert directory.usernames_in_org(org) == sorted(directory.usernames_in_org(org))
+
+
+def test_sqlite_round_trip(tmp_path):
+    users = datagen.generate_users(orgs=4, users=20, seed=2)
+    path = str(tmp_path / "users.db")
+    UserDirectory(users).to_sqlite(path)
+    assert dict(UserDirectory.from_path(path).items()) == users
+
+
+def test_generated_data_is_deterministic_and_usable():
+    users = datagen.generate_users(orgs=5, users=50, skew=1.5, seed=3)
+    assert users == datagen.generate_users(orgs=5, users=50, skew=1.5, seed=3)
+    assert len(users) == 50
+    # Every org can list, create and fulfill.
+    for org in (f"Org{i}" for i in range(5)):
+        roles = {user["role"] for user in users.values() if user["org"] == org}
+        assert roles == {"sales", "warehouse", "admin"}
+
+    orders = datagen.generate_orders(users, 200, seed=3)
+    assert orders == datagen.generate_orders(users, 200, seed=3)
+    for order in orders.values():
+        seller = users[order["sold_by"]]
+        assert (seller["org"], seller["role"]) == (order["org"], "sales")
@@ -0,0 +1,68 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, jsonify
+
+import wire_format
+
+ORDERS = [
+    {"id": str(n), "org": "Acme", "status": "pending", "items": ["anvil"]} for n in range(1, 51)
+]
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    wire_format.init_app(app)
+
+    @app.route("/orders")
+    def list_orders():
+        return jsonify(ORDERS)
+
+    @app.route("/orders/1")
+    def get_order():
+        return jsonify(ORDERS[0])
+
+    @app.route("/users")
+    def list_users():
+        return jsonify([{"name": "AcmeAdmin"}])
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize("accept", [None, "*/*", "application/json", "text/html"])
+def test_json_stays_the_default(client, accept):
+    headers = {"Accept": accept} if accept else {}
+    response = client.get("/orders", headers=headers)
+    assert response.mimetype == wire_format.JSON
+    assert response.get_json() == ORDERS
+    assert "Accept" in response.vary
+
+
+def test_columnar_json_on_request(client):
+    response = client.get("/orders", headers={"Accept": wire_format.COLUMNAR_JSON})
+    assert response.mimetype == wire_format.COLUMNAR_JSON
+    body = json.loads(response.get_data())
+    assert body["count"] == len(ORDERS)
+    assert body["columns"]["id"] == [order["id"] for order in ORDERS]
+    assert body["columns"]["org"] == {"dictionary": ["Acme"], "codes": [0] * len(ORDERS)}
+
+
+def test_only_order_lists_are_reencoded(client):
+    headers = {"Accept": wire_format.COLUMNAR_JSON}
+    single = client.get("/orders/1", headers=headers)
+    assert single.mimetype == wire_format.JSON
+    assert single.get_json() == ORDERS[0]
+    users = client.get("/users", headers=headers)
+    assert users.mimetype == wire_format.JSON
+    assert "Accept" not in users.vary
+
+
+def test_large_bodies_are_compressed_when_accepted(client):
+    plain = client.get("/orders")
+    assert "Content-Encoding" not in plain.headers
+
+    response = client.get("/orders", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.get_data())) == ORDERS
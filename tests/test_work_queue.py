@@ -0,0 +1,49 @@
+import pytest
+
+import work_queue
+from data import OrderStatus
+from order_service import OrderService
+from work_queue import WorkQueue
+
+
+@pytest.fixture
+def order():
+    order = OrderService.create_order("Acme", "AcmeSales1", "R. Runner", ["rocket skates"])
+    yield order
+    OrderService.delete_order(order["id"])
+
+
+def test_a_retry_only_reruns_the_hooks_that_failed(monkeypatch, order):
+    monkeypatch.setattr(work_queue, "RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(OrderService, "jobs", WorkQueue(workers=1))
+    calls = []
+
+    def notify(changed):
+        calls.append("notify")
+
+    def flaky(changed):
+        calls.append("flaky")
+        if calls.count("flaky") == 1:
+            raise ConnectionError("inventory service is down")
+
+    monkeypatch.setattr(OrderService, "status_hooks", [notify, flaky])
+    job = OrderService.update_order_status(order["id"], OrderStatus.FULFILLED, background=True)
+    assert job.wait(5)
+
+    assert job.status == "succeeded"
+    assert job.attempts == 2
+    assert calls == ["notify", "flaky", "flaky"]
+    assert OrderService.get_order(order["id"])["status"] == "fulfilled"
+
+
+def test_jobs_are_only_found_in_the_process_that_queued_them():
+    queue = WorkQueue(workers=1)
+    job = queue.submit("key", lambda: "done")
+    assert job.wait(5)
+    assert queue.is_local(job.id)
+    assert queue.get(job.id) is job
+
+    other_worker = WorkQueue(workers=1)
+    other_worker.submit("key", lambda: None).wait(5)
+    assert not other_worker.is_local(job.id)
+    assert other_worker.get(job.id) is None
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import sqlite3
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from data import USERS
+
+# User/organization directory
+#
+# Holds every user with indexes by username and by org. By default it's seeded
+# from `data.USERS`; set USER_DIRECTORY to a JSON file (same shape as USERS) or
+# a SQLite database (`users(username, org, role)`) to load a bigger one.
+
+
+class UserDirectory:
+    def __init__(self, users: Dict[str, dict]):
+        self._users: Dict[str, dict] = {}
+        self._by_org: Dict[str, List[str]] = {}
+        # Bumped on every change so caches derived from the directory can tell
+        # they're stale.
+        self.version = 0
+        # Called with the username after every put or remove.
+        self.listeners: List[Callable[[str], None]] = []
+        for username, user in users.items():
+            self._users[username] = {"org": user["org"], "role": user["role"]}
+            self._by_org.setdefault(user["org"], []).append(username)
+        for usernames in self._by_org.values():
+            usernames.sort()
+        self._sorted_usernames = sorted(self._users)
+
+    @classmethod
+    def from_json(cls, path: str) -> "UserDirectory":
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_sqlite(cls, path: str) -> "UserDirectory":
+        with sqlite3.connect(path) as conn:
+            rows = conn.execute("SELECT username, org, role FROM users").fetchall()
+        return cls({username: {"org": org, "role": role} for username, org, role in rows})
+
+    @classmethod
+    def from_path(cls, path: str) -> "UserDirectory":
+        if Path(path).suffix in (".db", ".sqlite", ".sqlite3"):
+            return cls.from_sqlite(path)
+        return cls.from_json(path)
+
+    def to_sqlite(self, path: str) -> None:
+        with sqlite3.connect(path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users "
+                "(username TEXT PRIMARY KEY, org TEXT NOT NULL, role TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS users_org ON users (org)")
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (username, org, role) VALUES (?, ?, ?)",
+                [(username, user["org"], user["role"]) for username, user in self.items()],
+            )
+
+    # Lookups
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._users
+
+    def get(self, username: str) -> Optional[dict]:
+        return self._users.get(username)
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        return iter(self._users.items())
+
+    def orgs(self) -> List[str]:
+        return sorted(self._by_org)
+
+    def usernames_in_org(self, org: str) -> List[str]:
+        return self._by_org.get(org, [])
+
+    def page(
+        self, org: Optional[str] = None, offset: int = 0, limit: Optional[int] = None
+    ) -> Tuple[List[Tuple[str, dict]], int]:
+        """Return one page of (username, user) pairs ordered by username, and
+        the total number of matching users."""
+        usernames = self._sorted_usernames if org is None else self.usernames_in_org(org)
+        end = None if limit is None else offset + limit
+        return [(name, self._users[name]) for name in usernames[offset:end]], len(usernames)
+
+    # Updates
+    def put(self, username: str, org: str, role: str) -> None:
+        previous = self._users.get(username)
+        if previous is not None:
+            _discard_sorted(self._by_org[previous["org"]], username)
+        else:
+            self._sorted_usernames.insert(bisect_left(self._sorted_usernames, username), username)
+
+        self._users[username] = {"org": org, "role": role}
+        org_users = self._by_org.setdefault(org, [])
+        org_users.insert(bisect_left(org_users, username), username)
+        self.version += 1
+        self._changed(username)
+
+    def remove(self, username: str) -> None:
+        user = self._users.pop(username, None)
+        if user is None:
+            return
+        _discard_sorted(self._by_org[user["org"]], username)
+        _discard_sorted(self._sorted_usernames, username)
+        self.version += 1
+        self._changed(username)
+
+    def _changed(self, username: str) -> None:
+        for listener in self.listeners:
+            listener(username)
+
+
+def _discard_sorted(values: List[str], value: str) -> None:
+    i = bisect_left(values, value)
+    if i < len(values) and values[i] == value:
+        del values[i]
+
+
+def load_directory() -> UserDirectory:
+    path = os.environ.get("USER_DIRECTORY")
+    if path:
+        directory = UserDirectory.from_path(path)
+        logging.info("Loaded %d users from %s", len(directory), path)
+        return directory
+    return UserDirectory(USERS)
+
+
+directory = load_directory()
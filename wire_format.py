@@ -0,0 +1,146 @@
+import gzip
+import os
+import zlib
+from dataclasses import is_dataclass
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, Response, has_request_context, make_response, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import msgpack
+except ImportError:  # optional: only offered when installed
+    msgpack = None
+
+# Content negotiation for the order endpoints
+#
+# By default responses are the same JSON the React client expects. Clients can
+# ask for more compact encodings of list responses:
+#
+# - `Accept: application/vnd.orders.columnar+json` returns one array per field
+#   instead of one object per order. String (and string list) columns with
+#   repeated values, like `org`, `status` or `permissions`, are sent as a
+#   dictionary of distinct values plus an index per row.
+# - `Accept: application/msgpack` returns the same columnar shape as MessagePack
+#   (only when the `msgpack` package is installed).
+#
+# Independently, bodies of at least COMPRESS_MIN_BYTES are gzip- or
+# deflate-compressed when the client's Accept-Encoding allows it.
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.orders.columnar+json"
+MSGPACK = "application/msgpack"
+
+ROUTE_PREFIX = "/orders"
+COMPRESS_MIN_BYTES = int(os.environ.get("WIRE_COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("WIRE_COMPRESS_LEVEL", "6"))
+
+
+def _hashable(value: Any):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+def columnar(rows: List[Dict[str, Any]]) -> dict:
+    """`rows` as {"count": n, "columns": {field: values}}, where a column with
+    repeated strings is {"dictionary": [distinct values], "codes": [index per row]}."""
+    fields: Dict[str, None] = {}
+    for row in rows:
+        fields.update(dict.fromkeys(row))
+
+    columns = {}
+    for field in fields:
+        values = [row.get(field) for row in rows]
+        columns[field] = values
+        if not all(isinstance(value, (str, list, tuple)) for value in values):
+            continue
+
+        dictionary, codes, index = [], [], {}
+        for value in values:
+            key = _hashable(value)
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(dictionary)
+                dictionary.append(value)
+            codes.append(code)
+        # Only worth it when values actually repeat.
+        if len(dictionary) * 2 <= len(values):
+            columns[field] = {"dictionary": dictionary, "codes": codes}
+
+    return {"count": len(rows), "columns": columns}
+
+
+def _negotiated() -> Optional[str]:
+    if not has_request_context() or not request.path.startswith(ROUTE_PREFIX):
+        return None
+    offered = [JSON, COLUMNAR_JSON] + ([MSGPACK] if msgpack is not None else [])
+    mimetype = request.accept_mimetypes.best_match(offered, default=JSON)
+    return None if mimetype == JSON else mimetype
+
+
+def _row(value: Any):
+    return vars(value) if is_dataclass(value) else value
+
+
+def _response_obj(args: tuple, kwargs: dict) -> Any:
+    # What `jsonify(*args, **kwargs)` serializes.
+    if args and kwargs:
+        raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+    if len(args) == 1:
+        return args[0]
+    return args or kwargs or None
+
+
+class NegotiatingJSONProvider(DefaultJSONProvider):
+    """`jsonify` that answers list responses in the encoding the client asked
+    for; anything else is plain JSON."""
+
+    def response(self, *args, **kwargs) -> Response:
+        mimetype = _negotiated()
+        obj = _response_obj(args, kwargs)
+        if mimetype is None or not isinstance(obj, list):
+            response = super().response(*args, **kwargs)
+        else:
+            rows = [_row(item) for item in obj]
+            body = columnar(rows)
+            if mimetype == MSGPACK:
+                data = msgpack.packb(body)
+            else:
+                data = self.dumps(body)
+            response = make_response(data)
+            response.mimetype = mimetype
+
+        if has_request_context() and request.path.startswith(ROUTE_PREFIX):
+            response.vary.add("Accept")
+        return response
+
+
+def compress(response: Response) -> Response:
+    if (
+        response.direct_passthrough
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or not request.path.startswith(ROUTE_PREFIX)
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = request.accept_encodings.best_match(["gzip", "deflate"])
+    if encoding is None:
+        return response
+
+    if encoding == "gzip":
+        response.set_data(gzip.compress(data, COMPRESS_LEVEL))
+    else:
+        response.set_data(zlib.compress(data, COMPRESS_LEVEL))
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def init_app(app: Flask) -> None:
+    app.json = NegotiatingJSONProvider(app)
+    app.after_request(compress)
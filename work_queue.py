@@ -0,0 +1,177 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional
+
+import metrics
+
+# In-process background jobs
+#
+# Jobs are run by a small pool of worker threads. Every job has a key, and jobs
+# with the same key (e.g. one order id) run one at a time in submission order;
+# different keys run in parallel. A failing job is retried with exponential
+# backoff. The queue holds at most MAX_DEPTH unfinished jobs, and the most
+# recent JOBS_KEPT finished ones stay around for status lookups.
+#
+# Jobs live in the worker process that queued them, so only that process can
+# report on one; `is_local` tells a job of another worker from an unknown one.
+
+WORKERS = int(os.environ.get("WORK_QUEUE_WORKERS", "4"))
+MAX_DEPTH = int(os.environ.get("WORK_QUEUE_MAX_DEPTH", "1000"))
+RETRIES = int(os.environ.get("WORK_QUEUE_RETRIES", "3"))
+RETRY_BACKOFF_SECONDS = float(os.environ.get("WORK_QUEUE_RETRY_BACKOFF_SECONDS", "0.1"))
+JOBS_KEPT = int(os.environ.get("WORK_QUEUE_JOBS_KEPT", "10000"))
+
+JOBS = metrics.Counter("work_queue_jobs_total", "Background jobs by outcome.", ("result",))
+JOB_SECONDS = metrics.Histogram(
+    "work_queue_job_seconds", "Time from submitting a background job to it finishing."
+)
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    key: str
+    fn: Callable[..., Any]
+    args: tuple
+    # Who submitted the job; only they may look it up.
+    owner: Optional[str] = None
+    status: str = "queued"  # "queued", "running", "succeeded" or "failed"
+    attempts: int = 0
+    result: Any = None
+    error: Optional[str] = None
+    submitted: float = field(default_factory=time.monotonic)
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class WorkQueue:
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        max_depth: int = MAX_DEPTH,
+        retries: int = RETRIES,
+        jobs_kept: int = JOBS_KEPT,
+    ):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.retries = retries
+        self.jobs_kept = jobs_kept
+        self._pid: Optional[int] = None
+        self._prefix = ""
+        self._start_lock = threading.Lock()
+
+    def _start(self) -> None:
+        # Worker threads don't survive a fork; each process starts its own.
+        self._cond = threading.Condition()
+        # Unfinished jobs per key, the running one first.
+        self._by_key: Dict[str, Deque[Job]] = {}
+        # Keys whose first job is ready to run.
+        self._ready: Deque[str] = deque()
+        self._depth = 0
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # Job ids start with this, so we can tell which process made them.
+        self._prefix = uuid.uuid4().hex[:8] + "-"
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"work-queue-{i}", daemon=True).start()
+        self._pid = os.getpid()
+
+    def submit(self, key: str, fn: Callable[..., Any], *args, owner: Optional[str] = None) -> Job:
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+
+        with self._cond:
+            if self._depth >= self.max_depth:
+                JOBS.inc("rejected")
+                raise QueueFull(f"{self._depth} jobs already queued")
+
+            job = Job(self._prefix + uuid.uuid4().hex, key, fn, args, owner)
+            self._depth += 1
+            self._remember(job)
+            pending = self._by_key.get(key)
+            if pending:
+                # Runs once the jobs ahead of it for this key are done.
+                pending.append(job)
+            else:
+                self._by_key[key] = deque([job])
+                self._ready.append(key)
+                self._cond.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        if not self.is_local(job_id):
+            return None
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def is_local(self, job_id: str) -> bool:
+        """Whether `job_id` was queued by this process (finished or not)."""
+        return self._pid == os.getpid() and job_id.startswith(self._prefix)
+
+    def _remember(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_depth + self.jobs_kept:
+            oldest = next(iter(self._jobs.values()))
+            if not oldest.done.is_set():
+                break
+            self._jobs.popitem(last=False)
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                job = self._by_key[key][0]
+                job.status = "running"
+
+            self._run(job)
+
+            with self._cond:
+                pending = self._by_key[key]
+                pending.popleft()
+                self._depth -= 1
+                if pending:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._by_key[key]
+
+    def _run(self, job: Job) -> None:
+        while True:
+            job.attempts += 1
+            try:
+                job.result = job.fn(*job.args)
+                job.status = "succeeded"
+                break
+            except Exception as e:
+                logging.exception("Job %s (%s) failed, attempt %d", job.id, job.key, job.attempts)
+                if job.attempts > self.retries:
+                    job.status, job.error = "failed", str(e)
+                    break
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1))
+
+        JOBS.inc(job.status)
+        JOB_SECONDS.observe(time.monotonic() - job.submitted)
+        job.done.set()